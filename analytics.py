@@ -0,0 +1,99 @@
+import json
+import time
+import argparse
+from datetime import datetime
+from resources.scripts.History import History
+from resources.scripts.TermColor import TermColor
+from resources.scripts.Analytics import time_out, overdue, utilization, per_student, peak_hours
+
+tc = TermColor()
+
+REPORTS = ["overdue", "out", "utilization", "students", "hours"]
+
+
+def stamp(ts):
+    """
+    Formats epoch seconds the way dates are written to the sheet.
+
+    Args:
+        ts (float): Epoch seconds.
+
+    Returns:
+        str: The local date and time.
+    """
+    moment = datetime.fromtimestamp(ts)
+    return f"{moment.day}/{moment.month}/{moment.year} {moment.hour:02d}:{moment.minute:02d}"
+
+
+def show(report, rows, top):
+    """
+    Prints a report as a table.
+
+    Args:
+        report (str): The report's name.
+        rows (list[dict]): The report's records.
+        top (int): Most rows printed, 0 for all.
+    """
+    tc.print_ok(f"{report} ({len(rows)} rows)")
+    for row in rows[:top or None]:
+        if report == "overdue":
+            print(f"  {row['device']:<16} {row['student']:<28} since {stamp(row['since'])} ({row['days_out']:.1f} days)")
+
+        elif report == "out":
+            print(f"  {row['device']:<16} {row['seconds_out'] / 3600:10.1f} h  {row['rentals']:5d} rentals"
+                  f"{'  (out now)' if row['out_now'] else ''}")
+
+        elif report == "utilization":
+            print(f"  {row['category']:<16} {row['utilization']:7.1%}  {row['hours_out']:10.1f} h over {row['devices']} devices")
+
+        elif report == "students":
+            print(f"  {row['student']:<28} {row['rentals']:5d} rentals  {row['holding']} held now")
+
+        elif report == "hours":
+            print(f"  {row['hour']:02d}:00  {row['rentals']:6d} rentals  {row['returns']:6d} returns")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on the local scan history without using the Sheets API.")
+    # No choices here, argparse checks an empty list against them and rejects running without names
+    parser.add_argument("reports", nargs="*", metavar="report",
+                        help=f"reports to print, any of {', '.join(REPORTS)} (default: overdue utilization)")
+    parser.add_argument("--history", default="resources/data/history.ndjson", help="the scan history file")
+    parser.add_argument("--days", type=float, default=3, help="days after which a rented device is overdue")
+    parser.add_argument("--period", type=float, default=30, help="days back the utilization report covers")
+    parser.add_argument("--top", type=int, default=20, help="most rows printed per report, 0 for all")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON instead of tables")
+    args = parser.parse_args()
+    args.reports = args.reports or ["overdue", "utilization"]
+    for name in args.reports:
+        if name not in REPORTS:
+            parser.error(f"argument report: invalid choice: {name!r} (choose from {', '.join(REPORTS)})")
+
+    start = time.perf_counter()
+    cols = History(args.history).columns()
+    now = time.time()
+    results = {}
+    for name in args.reports:
+        if name == "overdue":
+            results[name] = overdue(cols, now, args.days)
+
+        elif name == "out":
+            results[name] = time_out(cols, now)
+
+        elif name == "utilization":
+            results[name] = utilization(cols, now - args.period * 86400, now)
+
+        elif name == "students":
+            results[name] = per_student(cols, now)
+
+        elif name == "hours":
+            results[name] = peak_hours(cols)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+
+    else:
+        for name, rows in results.items():
+            show(name, rows, args.top)
+
+        tc.print_ok(f"{len(cols['ts'])} scans analysed in {(time.perf_counter() - start) * 1000:.0f} ms")
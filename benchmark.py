@@ -0,0 +1,381 @@
+import os
+import sys
+import cv2
+import json
+import time
+import argparse
+import platform
+import contextlib
+import subprocess
+import numpy as np
+from datetime import datetime
+from resources.scripts.Camera import Camera
+from resources.scripts.Decoder import DecodePipeline
+from resources.scripts.ImageTools import PreviewRenderer
+from resources.scripts.QRProcessor import QRProcessor
+from resources.scripts.Registry import DeviceRegistry
+from resources.scripts.Sheets import update, load_all, status_copies, _states
+from resources.scripts.Sources import open_source
+from resources.scripts.Storage import MemoryBackend, seed_from_codes
+from resources.scripts.TermColor import TermColor
+from resources.scripts.Exceptions import UnknownQRCodeException, BadOrderException, StopExecution
+
+tc = TermColor()
+
+CODE_FOLDERS = ["chromebooks", "calcs", "textbooks"]
+
+
+def timed(fn, repeat):
+    """
+    Runs a function several times and returns how long each run took.
+
+    Args:
+        fn (Callable[[], object]): The function to time.
+        repeat (int): Number of runs.
+
+    Returns:
+        list[float]: Milliseconds per run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return times
+
+
+def summarize(name, times, **extra):
+    """
+    Builds a result record from a list of timings.
+
+    Args:
+        name (str): The benchmark's name. Used as the key when comparing runs.
+        times (list[float]): Milliseconds per run.
+        **extra: Any other measurements to keep with the result.
+
+    Returns:
+        dict: The result record.
+    """
+    ordered = sorted(times)
+    return {
+        "name": name,
+        "unit": "ms",
+        "n": len(times),
+        "median": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "mean": sum(times) / len(times),
+        **extra,
+    }
+
+
+def on_canvas(code, scale=1.0, size=(640, 480)):
+    """
+    Places a QR code image on a camera sized grey background.
+
+    Args:
+        code (np.ndarray): The QR code image.
+        scale (float): Size of the code relative to 300 pixels wide, about a card held up to a webcam.
+        size (tuple[int, int]): The (width, height) of the canvas.
+
+    Returns:
+        np.ndarray: The composed frame.
+    """
+    width = int(300 * scale)
+    code = cv2.resize(code, (width, width * code.shape[0] // code.shape[1]), interpolation=cv2.INTER_AREA)
+    canvas = np.full((size[1], size[0], 3), 160, dtype=np.uint8)
+    h, w = min(code.shape[0], size[1]), min(code.shape[1], size[0])
+    y, x = (size[1] - h) // 2, (size[0] - w) // 2
+    canvas[y:y + h, x:x + w] = code[:h, :w]
+    return canvas
+
+
+def variants(code):
+    """
+    Builds the distorted versions of a QR code the decoder is measured on.
+
+    Args:
+        code (np.ndarray): The QR code image.
+
+    Returns:
+        dict[str, np.ndarray]: Variant name mapped to its frame.
+    """
+    frame = on_canvas(code)
+    centre = (frame.shape[1] / 2, frame.shape[0] / 2)
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 25, frame.shape)
+    return {
+        "plain": frame,
+        "rotated-15": cv2.warpAffine(frame, cv2.getRotationMatrix2D(centre, 15, 1.0), frame.shape[1::-1],
+                                     borderValue=(160, 160, 160)),
+        "rotated-45": cv2.warpAffine(frame, cv2.getRotationMatrix2D(centre, 45, 1.0), frame.shape[1::-1],
+                                     borderValue=(160, 160, 160)),
+        "blurred": cv2.GaussianBlur(frame, (7, 7), 0),
+        "scaled-0.5": on_canvas(code, 0.5),
+        "scaled-1.5": on_canvas(code, 1.5),
+        "noisy": np.clip(frame + noise, 0, 255).astype(np.uint8),
+    }
+
+
+def bench_decode(repeat, limit):
+    """
+    Measures the decode path used by the scanner on every folder of printed codes.
+
+    Args:
+        repeat (int): Runs per frame.
+        limit (int): Most codes used per folder.
+
+    Returns:
+        list[dict]: One result per folder and variant.
+    """
+    pipeline = DecodePipeline(workers=1)
+    results = []
+    for folder in CODE_FOLDERS:
+        files = sorted(os.listdir(f"resources/qr_codes/{folder}"))[:limit]
+        per_variant = {}
+        for file in files:
+            expected = file.removesuffix(".png")
+            for name, frame in variants(cv2.imread(f"resources/qr_codes/{folder}/{file}")).items():
+                times, hits = per_variant.setdefault(name, ([], [0]))
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    text, _ = pipeline.detect(frame)
+                    times.append((time.perf_counter() - start) * 1000)
+                    hits[0] += text == expected
+
+        for name, (times, hits) in per_variant.items():
+            results.append(summarize(f"decode/{folder}/{name}", times, decoded=hits[0] / len(times)))
+
+    pipeline.close()
+    return results
+
+
+def bench_render(repeat):
+    """
+    Measures the per-frame preview work done by read_code.
+
+    Args:
+        repeat (int): Frames rendered per window size.
+
+    Returns:
+        list[dict]: One result per window size.
+    """
+    frame = on_canvas(cv2.imread("resources/qr_codes/calcs/CALC-01.png"))
+    renderer = PreviewRenderer()
+    return [
+        summarize(f"render/{w}x{h}", timed(lambda: renderer.render(frame, "Show Rental", (w, h)), repeat))
+        for w, h in [(640, 480), (800, 600), (1280, 720)]
+    ]
+
+
+def bench_flush(repeat, sizes):
+    """
+    Measures Sheets.update grouping and write planning against the in-memory backend.
+
+    Args:
+        repeat (int): Flushes per queue size.
+        sizes (list[int]): The queue sizes to flush.
+
+    Returns:
+        list[dict]: One result per queue size.
+    """
+    results = []
+    for size in sizes:
+        backend = MemoryBackend()
+        seed_from_codes(backend)
+        _states.clear()
+        load_all(backend)
+
+        devices = [name for table in backend.statuses.values() for name in table]
+        actions = ["OUT", "IN"]
+        times = []
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for run in range(repeat):
+                entries = [
+                    {"device": devices[i % len(devices)], "action": actions[(i // len(devices) + run) % 2],
+                     "student": "Student Name", "date": "1/9/2024", "time": "12:00:00"}
+                    for i in range(size)
+                ]
+                start = time.perf_counter()
+                update(entries, backend)
+                times.append((time.perf_counter() - start) * 1000)
+
+        results.append(summarize(f"flush/{size}", times, requests=backend.requests,
+                                 cells_written=backend.cells_written))
+
+    return results
+
+
+def bench_scan(spec, realtime, dual=False):
+    """
+    Measures end to end scanning, from frames to accepted checkouts, without a window.
+
+    Checkouts are scanned like main.py does, a device and then, if the source shows student IDs,
+    the ID. Each code read is held like the scanner does after a scan, so a card is only counted
+    once while it stays in view.
+
+    Args:
+        spec (str): The frame source, see Sources.open_source. It must finish, e.g. "synthetic:20".
+        realtime (bool): Whether to replay the source at its own rate instead of as fast as possible.
+        dual (bool): Whether a device and an ID shown together are read in one step, like main.py --dual.
+
+    Returns:
+        list[dict]: One result, the time taken by each checkout along with throughput and accuracy.
+    """
+    backend = MemoryBackend()
+    seed_from_codes(backend)
+    _states.clear()
+    registry = DeviceRegistry()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for category, state in load_all(backend).items():
+            registry.load(category, status_copies(state))
+
+    source = open_source(spec)
+    students = getattr(source, "students", {})
+    camera = Camera(source, realtime=realtime).start()
+    qr_proc = QRProcessor(students, camera, pipeline=DecodePipeline(multi=dual), headless=True)
+    reads = []
+    times = []
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        while True:
+            began = time.perf_counter()
+            try:
+                student = None
+                if dual:
+                    device, student = qr_proc.read_pair("Show Rental and ID", registry)
+                    device = device if student is not None else qr_proc.process_code(device, registry, "rental")
+
+                else:
+                    device = qr_proc.process_code(qr_proc.read_code("Show Rental", registry), registry, "rental")
+
+                if students and student is None:
+                    student = qr_proc.process_code(qr_proc.read_code("Show ID", registry), registry, "student")
+
+            except (UnknownQRCodeException, BadOrderException):
+                continue
+
+            except StopExecution:
+                break
+
+            times.append((time.perf_counter() - began) * 1000)
+            reads.append((device, student))
+
+    elapsed = time.perf_counter() - start
+    qr_proc.close()
+    camera.release()
+
+    extra = {"frames": camera.frame_id, "frames_per_s": camera.frame_id / elapsed, "reads": len(reads),
+             "reads_per_s": len(reads) / elapsed}
+    shown = getattr(source, "shown", None)
+    if shown:
+        names = [students[data] for data in getattr(source, "shown_ids", [])] or [None] * len(shown)
+        expected = set(zip(shown, names))
+        extra["cards"] = len(shown)
+        extra["recall"] = len(set(reads) & expected) / len(expected)
+        extra["wrong"] = sum(read not in expected for read in reads)
+
+    mode = ("realtime" if realtime else "fast") + ("/dual" if dual else "")
+    return [summarize(f"scan/{spec}/{mode}", times or [0.0], **extra)]
+
+
+def compare(old_path, results, threshold):
+    """
+    Prints benchmarks whose median got slower than in an earlier run.
+
+    Args:
+        old_path (str): The earlier run's results file.
+        results (list[dict]): This run's results.
+        threshold (float): Fractional slowdown that counts as a regression.
+
+    Returns:
+        int: The number of regressions found.
+    """
+    with open(old_path, "r") as f:
+        old = {r["name"]: r for r in json.load(f)["results"]}
+
+    regressions = 0
+    for result in results:
+        if result["name"] not in old:
+            continue
+
+        change = result["median"] / old[result["name"]]["median"] - 1
+        if change > threshold:
+            regressions += 1
+            tc.print_warning(f"{result['name']}: {old[result['name']]['median']:.3f} -> {result['median']:.3f} ms "
+                             f"({change:+.0%})")
+
+    if regressions == 0:
+        tc.print_ok("No regressions")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the decode, render, sheet flush and scanning hot paths.")
+    parser.add_argument("--only", choices=["decode", "render", "flush", "scan"], action="append",
+                        help="run only these parts (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    parser.add_argument("--limit", type=int, default=10, help="most QR codes used per folder for decode")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="queue sizes for the flush benchmark")
+    parser.add_argument("--source", default="synthetic:10",
+                        help="frame source scanned end to end, a video, a directory of images or synthetic:<cards>, "
+                             "synthetic-ids:<cards> or synthetic-pairs:<cards> to add student IDs")
+    parser.add_argument("--realtime", action="store_true",
+                        help="replay the scan source at its own rate instead of as fast as possible")
+    parser.add_argument("--dual", action="store_true",
+                        help="scan a device and an ID shown together in one step, like main.py --dual")
+    parser.add_argument("--out", default=f"logs/bench_{time.strftime('%Y-%m-%d_%H%M%S')}.json",
+                        help="where to write the results")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    parts = args.only or ["decode", "render", "flush", "scan"]
+    results = []
+    if "decode" in parts:
+        tc.print_ok("Benchmarking decode")
+        results.extend(bench_decode(args.repeat, args.limit))
+
+    if "render" in parts:
+        tc.print_ok("Benchmarking render")
+        results.extend(bench_render(args.repeat * 20))
+
+    if "flush" in parts:
+        tc.print_ok("Benchmarking flush")
+        results.extend(bench_flush(args.repeat, args.sizes))
+
+    if "scan" in parts:
+        tc.print_ok(f"Benchmarking scanning from {args.source}")
+        results.extend(bench_scan(args.source, args.realtime, args.dual))
+
+    for result in results:
+        print(f"  {result['name']:<36} median {result['median']:9.3f} ms   p95 {result['p95']:9.3f} ms")
+        if result["name"].startswith("scan/"):
+            print(f"  {'':<36} {result['frames_per_s']:.1f} frames/s, {result['reads_per_s']:.2f} reads/s"
+                  + (f", recall {result['recall']:.0%}, {result['wrong']} wrong" if "recall" in result else ""))
+
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+
+    except OSError:
+        revision = ""
+
+    with open(args.out, "w") as f:
+        json.dump({
+            "meta": {
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "revision": revision,
+                "python": platform.python_version(),
+                "opencv": cv2.__version__,
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+            },
+            "results": results,
+        }, f, indent=4)
+
+    tc.print_ok(f"Wrote {args.out}")
+    if args.compare:
+        sys.exit(1 if compare(args.compare, results, args.threshold) > 0 else 0)
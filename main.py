@@ -1,120 +1,259 @@
+# Imported before anything else so the startup profile includes the time spent importing
+from resources.scripts.Startup import startup
 import cv2
 import gspread
-import numpy as np
+import argparse
 import threading as th
-from tqdm import tqdm
-from time import sleep
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, Future
 from resources.scripts.FileIO import read
+from resources.scripts.Camera import Camera
+from resources.scripts.Sources import open_source
+from resources.scripts.Decoder import DecodePipeline
+from resources.scripts.Journal import Journal
+from resources.scripts.History import History
+from resources.scripts.Registry import DeviceRegistry
+from resources.scripts.Writer import SheetWriter, make_entry
 from resources.scripts.Logging import write_log
+from resources.scripts.Metrics import metrics
 from resources.scripts.TermColor import TermColor
 from resources.scripts.QRProcessor import QRProcessor
-from resources.scripts.Sheets import update, pull_statuses
-from gspread import Cell, Worksheet, Spreadsheet, service_account
+from resources.scripts.Settings import settings
+from resources.scripts.Validation import validation
+from resources.scripts.Sheets import (
+    SheetState, open_sheets, load_all, load_snapshot, save_snapshot, sheet_state, status_copies, reconcile,
+    report_conflicts
+)
+from resources.scripts.Storage import (
+    StorageBackend, GspreadBackend, LazyBackend, SQLiteBackend, MemoryBackend, seed_from_codes
+)
+from gspread import service_account
 from resources.scripts.Exceptions import BadOrderException, UnknownQRCodeException, StopExecution
 
-timer = None
+startup.mark("imports")
 
-def update_sheet_in_thread(ent, shts):
+SNAPSHOT = "resources/data/snapshot.json"
+METRICS = "logs/metrics.jsonl"
+HISTORY = "resources/data/history.ndjson"
+
+
+def open_backend(kind, path):
     """
-    Updates the sheet if there are entries and restarts the timer.
+    Opens the storage scans are written to.
 
-    Checks if there are any entries in the given list. If there are,
-    it triggers the update function to update the given sheet with updates in the queue.
-    After the update, it clears the queue and restarts the timer for the next update.
+    The local backends are filled with a device for every printed QR code
+    so the scanner can run without the spreadsheet. The spreadsheet is opened
+    lazily, if it cannot be reached the scanner starts offline.
 
     Args:
-        ent (list[dict[str, str]]): A list of entries to be updated on the sheet.
-        shts (dict[str, Worksheet]): The sheet object that needs to be updated.
+        kind (str): One of "sheets", "sqlite" or "memory".
+        path (str): The database file used by the sqlite backend.
+
+    Returns:
+        StorageBackend: The opened storage.
     """
-    if len(ent) == 0:
-        tc.print_ok("No entries. Skipping update.")
-    else:
-        update(ent, shts)
-        ent.clear()
+    if kind == "sheets":
+        client: service_account = gspread.service_account_from_dict(read("resources/data/api_key.json"))
+        backend = LazyBackend(lambda: GspreadBackend(open_sheets(client, retry=False)))
+        try:
+            backend.live()
+
+        except (Exception,):
+            tc.print_warning("Could not reach the spreadsheet. Starting offline")
+            write_log()
+
+        return backend
 
-    # Restart the timer after the update is done
-    start_timer(ent, shts)
+    backend = SQLiteBackend(path) if kind == "sqlite" else MemoryBackend()
+    seed_from_codes(backend)
+    return backend
 
 
-def start_timer(ent, shts):
+def refresh_devices(bknd, reg, wrtr):
     """
-    Starts a timer to trigger the update every 100 seconds.
+    Reconciles device statuses loaded from the snapshot, or kept while offline, with the live sheet.
 
-    Sets a timer that will call `update_sheet_in_thread` after 100 seconds.
-    The timer runs in a separate thread, allowing the rest of the program to continue
-    execution while waiting for the next update.
+    Reads every category in one batched request, overwrites the local statuses with
+    what the storage holds, then re-applies scans still waiting in the queue on top.
+    Devices changed on the sheet that also have waiting scans are reported as conflicts.
 
     Args:
-        ent (list[dict[str, str]]): A list of entries to be passed to the update function.
-        shts (dict[str, Worksheet]): The sheet object to be updated when the timer triggers.
+        bknd (StorageBackend): The storage to read from.
+        reg (DeviceRegistry): The local device statuses, updated in place.
+        wrtr (SheetWriter): The writer holding the scans waiting to be pushed.
+
+    Returns:
+        bool: Whether the sheet could be reached.
     """
-    global timer
-    if isinstance(timer, th.Timer) and timer.is_alive():
-        timer.cancel()
+    try:
+        fresh, conflicts = reconcile(bknd, wrtr.pending())
 
-    timer = th.Timer(100, update_sheet_in_thread, args=(ent, shts))
-    timer.start()
+    except (Exception,):
+        tc.print_warning("Could not refresh statuses from the sheet. Continuing offline with local statuses")
+        write_log()
+        return False
 
+    for name, state in fresh.items():
+        reg.load(name, status_copies(state))
 
-def stop_timer():
-    """
-    Cancels the running timer if it's active.
-    """
-    global timer
-    if isinstance(timer, th.Timer) and timer.is_alive():
-        timer.cancel()
+    for pending in wrtr.pending():
+        reg.set_status(pending["device"], pending["action"])
+
+    report_conflicts(conflicts)
+    save_snapshot(SNAPSHOT, bknd)
+    tc.print_ok("Device statuses are up to date with the sheet")
+    return True
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track the renting and returning of chromebooks.")
+    parser.add_argument("--storage", choices=["sheets", "sqlite", "memory"], default="sheets",
+                        help="where scans are written (default: the Google spreadsheet)")
+    parser.add_argument("--database", default="resources/data/tracker.db",
+                        help="database file for --storage sqlite")
+    parser.add_argument("--roster", help="create QR codes for every name in this CSV file and exit")
+    parser.add_argument("--cameras", type=int, nargs="+", default=[0],
+                        help="camera indexes to scan from, one station process each when more than one is given")
+    parser.add_argument("--source",
+                        help="scan a video file, a directory of images or \"synthetic[:cards]\" instead of a camera")
+    parser.add_argument("--fast", action="store_true",
+                        help="replay --source as fast as frames can be scanned instead of in real time")
+    parser.add_argument("--dual", action="store_true",
+                        help="accept a device and an ID shown together in one step, one at a time still works")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each step of startup took once scanning can begin")
+    args = parser.parse_args()
+    if args.source and len(args.cameras) > 1:
+        parser.error("--source replaces the camera and cannot be used with several --cameras")
+
     tc: TermColor = TermColor()
+
+    if args.roster:
+        from pwinput import pwinput
+
+        try:
+            QRProcessor.create_qr_codes_from_roster(
+                args.roster,
+                "resources/qr_codes/output",
+                fuzz=pwinput(f"Fuzzer for convolution (Ex. John{tc.format('fuzz', 'fail')}Doe): ")
+            )
+
+        except StopExecution:
+            exit(-1)
+
+        exit(0)
+
     tc.print_ok("Setting up")
 
     # variables
     entry: dict[str, str] = {}
-    devices: dict[str, dict[str, Cell]] = {}
-    accepted: list[str] = []
+    registry: DeviceRegistry = DeviceRegistry()
 
-    # file i/o and images
+    # file i/o
     try:
-        decrypt: dict[str, str] = read("resources/data/validation.json")
-        settings: dict[str, str] = read("resources/data/settings.json")
-        updating: np.ndarray = cv2.imread("resources/img/updating.png")
+        with startup.phase("settings"):
+            settings.get()
 
     except StopExecution:
         exit(-1)
 
-    # gspread setup
-    client: service_account = gspread.service_account_from_dict(read("resources/data/api_key.json"))
-
-    main_sheet: Spreadsheet = client.open("Chromebook Tracker")
-    sheets: dict[str, Worksheet] = {
-        "chromebook": main_sheet.worksheet(settings["chromebook sheet"]),
-        "calculator": main_sheet.worksheet(settings["calculator sheet"]),
-        "religion": main_sheet.worksheet(settings["religion sheet"]),
-        "science": main_sheet.worksheet(settings["science sheet"]),
-        # "testing": main_sheet.worksheet("testing"),
-    }
-
-    # Update statuses of all rentals
-    for name, sheet in tqdm(
-            sheets.items(),
-            unit=" sheets",
-            desc="Pulling sheet data",
-            colour="white",
-            dynamic_ncols=True,
-            bar_format="{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [Elapsed: {elapsed}]"
-    ):
-        devices[name] = pull_statuses(sheet)
-        accepted.extend([*devices[name].keys()])
+    # The student store, camera and decoders come up on their own threads while the sheet is loaded below
+    boot: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup")
+    students: Future = boot.submit(startup.timed, "students", len, validation)
+    if len(args.cameras) == 1:
+        camera: Camera = Camera(open_source(args.source) if args.source else args.cameras[0], realtime=not args.fast)
+        camera_ready: Future = boot.submit(startup.timed, "camera", camera.start)
+        pipeline_ready: Future = boot.submit(startup.timed, "decoder warm-up", DecodePipeline(multi=args.dual).warm_up)
+
+    # gspread setup, or a local stand-in for the spreadsheet
+    with startup.phase("storage"):
+        backend: StorageBackend = open_backend(args.storage, args.database)
+
+    # Come up from the last snapshot if there is one and reconcile with the sheet in the background
+    with startup.phase("statuses"):
+        if load_snapshot(SNAPSHOT, backend):
+            tc.print_ok("Loaded device statuses from snapshot. Refreshing from the sheet in the background")
+            states: dict[str, SheetState] = {name: sheet_state(name) for name in backend.categories()}
+            refresh_needed: bool = True
+
+        else:
+            tc.print_ok("Pulling sheet data")
+            try:
+                states: dict[str, SheetState] = load_all(backend)
+
+            except (Exception,):
+                tc.print_fatal("Could not reach the sheet and there is no snapshot to work offline from")
+                write_log()
+                exit(-1)
+
+            save_snapshot(SNAPSHOT, backend)
+            refresh_needed: bool = False
+
+        for name, state in states.items():
+            registry.load(name, status_copies(state))
+
+    # Recover any scans that were queued but never pushed before the last shutdown or crash
+    with startup.phase("journal"):
+        journal: Journal = Journal("resources/data/journal.ndjson")
+        writer: SheetWriter = SheetWriter(backend, journal, SNAPSHOT,
+                                          reconnect=lambda: refresh_devices(backend, registry, writer),
+                                          history=History(HISTORY))
+    if writer.depth() > 0:
+        tc.print_warning(f"Recovered {writer.depth()} unsaved scans from the journal")
+        for recovered in writer.pending():
+            registry.set_status(recovered["device"], recovered["action"])
+
+    # Nothing is pushed until the snapshot has been reconciled with the sheet, scanning carries on meanwhile
+    if refresh_needed:
+        writer.offline = True
+        th.Thread(target=writer.reconnect, daemon=True).start()
+
+    # Start pushing scans to the sheet in the background
+    writer.start()
+    metrics.start(METRICS)
 
-    # cv2
-    qr_proc: QRProcessor = QRProcessor(decrypt)
+    try:
+        with startup.phase("waiting"):
+            tc.print_ok(f"Loaded {students.result()} students")
+
+    except StopExecution:
+        writer.stop()
+        journal.close()
+        metrics.stop()
+        exit(-1)
+
+    # Several checkout lines, each scanning in its own process and sharing this process' statuses and writer
+    if len(args.cameras) > 1:
+        # Only imported for several cameras since it brings in multiprocessing
+        from resources.scripts.Stations import StationCoordinator
 
-    entries: list[dict[str, str]] = []
+        boot.shutdown()
+        if args.profile_startup:
+            for line in startup.report():
+                print(line)
+
+        tc.print_ok(f"Starting {len(args.cameras)} stations")
+        coordinator: StationCoordinator = StationCoordinator(args.cameras, registry, writer).start()
+        try:
+            coordinator.run()
 
-    # Start the initial timer
-    start_timer(entries, sheets)
+        except KeyboardInterrupt:
+            tc.print_ok("Exiting")
+
+        coordinator.stop()
+        writer.stop()
+        journal.close()
+        metrics.stop()
+        exit(0)
+
+    # cv2
+    with startup.phase("waiting"):
+        camera_ready.result()
+        qr_proc: QRProcessor = QRProcessor(validation, camera, pipeline=pipeline_ready.result())
+
+    boot.shutdown()
+    if args.profile_startup:
+        for line in startup.report():
+            print(line)
 
     while True:
         try:
@@ -122,42 +261,29 @@ if __name__ == "__main__":
             student: str
             action: str
 
-            # Scan QR codes for ID and rental
-            device = qr_proc.process_code(qr_proc.read_code("Show Rental", accepted), accepted, "rental")
-            student = qr_proc.process_code(qr_proc.read_code("Show ID", accepted), accepted, "student")
-
-            swap = {"IN": "OUT", "OUT": "IN"}
-            if device in devices['chromebook']:
-                action = swap[devices['chromebook'][device].value]
-                devices['chromebook'][device].value = action
-            elif device in devices['calculator']:
-                action = swap[devices['calculator'][device].value]
-                devices['calculator'][device].value = action
-            elif device in devices['religion']:
-                action = swap[devices['religion'][device].value]
-                devices['religion'][device].value = action
-            elif device in devices['science']:
-                action = swap[devices['science'][device].value]
-                devices['science'][device].value = action
+            # Scan QR codes for ID and rental, both at once in dual mode
+            if args.dual:
+                device, student = qr_proc.read_pair("Show Rental and ID", registry)
+
+                # Only one code was shown, carry on one code at a time
+                if student is None:
+                    device = qr_proc.process_code(device, registry, "rental")
+                    student = qr_proc.process_code(qr_proc.read_code("Show ID", registry), registry, "student")
+
             else:
+                device = qr_proc.process_code(qr_proc.read_code("Show Rental", registry), registry, "rental")
+                student = qr_proc.process_code(qr_proc.read_code("Show ID", registry), registry, "student")
+
+            if device not in registry:
                 print("Unknown device scanned.")
                 continue
 
-            # Wait so user can pull old QR code out of the way
-            cv2.waitKey(500)
-            cv2.imshow("Scanner", updating)
-            cv2.waitKey(1)
-
-            # Add updates to queue
-            # Look at using file for queue to preserve data in case crash
-            entry = {}
-            current_time: datetime = datetime.now()
-            entry["action"] = action
-            entry["device"] = device
-            entry["date"] = f"{current_time.day}/{current_time.month}/{current_time.year}"
-            entry["student"] = student
-            entry["time"] = f"{current_time.hour:02d}:{current_time.minute:02d}:{current_time.second:02d}"
-            entries.append(entry)
+            action = registry.toggle(device)
+            qr_proc.notify(f"{device} checked {action}", 1.5)
+
+            # Add updates to queue, journaling first so the scan survives a crash
+            entry = make_entry(device, student, action, registry.category_of(device))
+            writer.put(entry)
 
         # Handle OpenCV errors (if any)
         except cv2.error:
@@ -170,19 +296,22 @@ if __name__ == "__main__":
         except UnknownQRCodeException:
             continue
 
-        # Handle reaching of API usage limit
-        except gspread.exceptions.APIError:
-            tc.print_fatal("API limit reached. Give me 100 seconds to cool down...")
-            sleep(100)
-            tc.print_ok("Done cooling down. Restart the program now.")
-
-        # Stop the timer before exiting
+        # Push what is left and release the camera before exiting
         except StopExecution:
-            stop_timer()
+            writer.stop()
+            journal.close()
+            metrics.stop()
+            qr_proc.close()
+            camera.release()
             break
 
         # Catch any other exceptions
         except (Exception,):
+            writer.stop()
+            journal.close()
+            metrics.stop()
+            qr_proc.close()
+            camera.release()
             cv2.destroyAllWindows()
             tc.print_fatal("Unknown error occurred. See logs for more details.")
             write_log()
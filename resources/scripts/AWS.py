@@ -1,38 +1,278 @@
+import os
 import json
+import zlib
 import base64
-import requests
 from hashlib import sha256
 from pwinput import pwinput
-from requests import Response
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from resources.scripts.Settings import settings
+from resources.scripts.Validation import validation
 from resources.scripts.TermColor import TermColor
 from resources.scripts.Exceptions import StopExecution
 
 tc = TermColor()
 
+# Version of the sync protocol spoken to the endpoints, servers without it get the original form posts
+PROTOCOL: int = 2
+
+# What both kinds of endpoint answer, with a 200 status, when the password is wrong
+UNAUTHORIZED: str = "Unauthorized: Bad password"
+
+# Where each synced document is stored locally
+DOCUMENTS: dict[str, str] = {
+    "apikey": "resources/data/api_key.json",
+    "validation": "resources/data/validation.json",
+}
 
-def _pull(pwd: str) -> None:
-    """Retrieves data from AWS and stores it in local files.
+
+def content_hash(data: dict) -> str:
+    """Hashes a document independently of key order and whitespace.
 
     Args:
-        pwd: The password to authenticate with the AWS endpoint.
+        data: The document.
+
+    Returns:
+        The hex digest used to tell whether a document changed.
     """
+    return sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class SyncClient:
+    def __init__(self, state_path: str = "resources/data/sync_state.json", retries: int = 4, timeout: float = 30.0):
+        """Initializes the client that syncs the API key and validation data with AWS.
+
+        Requests go through one pooled session that retries connection errors and 429/5xx
+        responses. The hash of each document as last synced is kept in state_path so unchanged
+        documents are skipped, and the last synced validation data is kept so only added and
+        removed students are sent.
+
+        Args:
+            state_path: Where the sync state is kept.
+            retries: How many times a failed request is retried.
+            timeout: Seconds to wait for a response.
+        """
+        self.state_path: str = state_path
+        self.timeout: float = timeout
+        self.session: Session = Session()
+        adapter: HTTPAdapter = HTTPAdapter(max_retries=Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        ))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.state: dict = self._load_state()
+
+    def _load_state(self) -> dict:
+        """Reads the sync state, starting fresh if it is missing or unreadable."""
+        try:
+            with open(self.state_path, "r") as f:
+                state: dict = json.load(f)
+
+        except (OSError, ValueError):
+            state = {}
+
+        state.setdefault("documents", {})
+        state.setdefault("validation", None)
+        state.setdefault("protocol", PROTOCOL)
+        return state
+
+    def _save_state(self) -> None:
+        """Writes the sync state, replacing the old file only once the new one is complete."""
+        with open(f"{self.state_path}.tmp", "w") as f:
+            json.dump(self.state, f)
+
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+    @staticmethod
+    def _urls() -> tuple[str, str]:
+        """Returns the pull and push endpoints from settings."""
+        return settings.get().aws_pull_url, settings.get().aws_push_url
+
+    def _synced(self, kind: str, data: dict) -> None:
+        """Records a document as matching the copy stored on AWS."""
+        self.state["documents"][kind] = content_hash(data)
+        if kind == "validation":
+            self.state["validation"] = data
+
+    def pull(self, pwd: str) -> list[str]:
+        """Retrieves data from AWS and stores it in local files, skipping documents that did not change.
+
+        Args:
+            pwd: The password to authenticate with the AWS endpoint.
+
+        Returns:
+            The kinds of documents that were downloaded.
+        """
+        have: dict[str, str] = {}
+        for kind, path in DOCUMENTS.items():
+            try:
+                with open(path, "r") as f:
+                    have[kind] = content_hash(json.load(f))
+
+            except (OSError, ValueError):
+                pass
+
+        resp: Response = self.session.post(self._urls()[0], timeout=self.timeout, data={
+            "pass": sha256(pwd.encode()).hexdigest(),
+            "protocol": PROTOCOL,
+            "have": json.dumps(have),
+        })
+        returned: str = resp.content.decode("utf-8")
+
+        if returned == UNAUTHORIZED:
+            tc.print_fail(returned)
+            raise StopExecution
+
+        returned_data: dict = json.loads(returned)
+        if returned_data.get("protocol") == PROTOCOL:
+            documents: dict[str, dict] = {
+                kind: document["data"] for kind, document in returned_data["documents"].items() if "data" in document
+            }
+            for kind, document in returned_data["documents"].items():
+                if "data" not in document:
+                    tc.print_ok(f"{kind} is unchanged")
+                    self.state["documents"][kind] = document["hash"]
+
+        # The original endpoint sends both documents whole, as JSON strings
+        else:
+            documents = {
+                "apikey": json.loads(returned_data["api_key"]),
+                "validation": json.loads(returned_data["validation"]),
+            }
+
+        for kind, data in documents.items():
+            with open(DOCUMENTS[kind], "w") as f:
+                json.dump(data, f, indent=4)
+
+            self._synced(kind, data)
+
+        self._save_state()
+        return list(documents)
+
+    def push(self, kind: str, data: dict, pwd: str) -> str:
+        """Sends a document to AWS for storage, as a compressed delta when the server allows it.
+
+        Args:
+            kind: The type of data being sent, "apikey" or "validation".
+            data: The data to send to AWS.
+            pwd: The password to authenticate with the AWS endpoint.
 
-    url: str = "https://tryobgwrhsrnbyq5re77znzxry0brhfc.lambda-url.ca-central-1.on.aws/"
-    returned: str = requests.post(url, data={"pass": sha256(pwd.encode()).hexdigest()}).content.decode("utf-8")
+        Returns:
+            The response content from the AWS endpoint, or "unchanged" if nothing was sent.
+        """
+        digest: str = content_hash(data)
+        if self.state["documents"].get(kind) == digest:
+            tc.print_ok(f"{kind} is unchanged, not sending it")
+            return "unchanged"
 
-    if returned == "Unauthorized: Bad password":
-        tc.print_fail(returned)
-        raise StopExecution
+        url: str = self._urls()[1]
+        resp: Response | None = None
+        if self.state["protocol"] == PROTOCOL:
+            body: dict = {
+                "pass": sha256(pwd.encode()).hexdigest(),
+                "protocol": PROTOCOL,
+                "kind": kind,
+                "base": self.state["documents"].get(kind),
+                "hash": digest,
+            }
+            baseline: dict | None = self.state["validation"] if kind == "validation" else None
+            if baseline is not None and body["base"] is not None:
+                body["delta"] = {
+                    "added": {key: value for key, value in data.items() if baseline.get(key) != value},
+                    "removed": [key for key in baseline if key not in data],
+                }
 
-    returned_data: dict = json.loads(returned)
+            else:
+                body["data"] = data
 
-    # Store API key data
-    with open("resources/data/api_key.json", "w") as api:
-        json.dump(json.loads(returned_data["api_key"]), api, indent=4)
+            resp = self._post(url, body)
 
-    # Store validation data
-    with open("resources/data/validation.json", "w") as val:
-        json.dump(json.loads(returned_data["validation"]), val, indent=4)
+            # The server's copy is not the one the delta was made against, send the whole document
+            if resp is not None and resp.status_code == 409 and "delta" in body:
+                del body["delta"]
+                body["data"] = data
+                resp = self._post(url, body)
+
+            # Only a reply that is not an auth failure and not in the protocol means an older server
+            if resp is None:
+                tc.print_warning("Sync endpoint does not support deltas. Sending whole documents from now on")
+                self.state["protocol"] = 1
+
+        if resp is None:
+            resp = self.session.post(url, timeout=self.timeout, data={
+                "pass": sha256(pwd.encode()).hexdigest(),
+                "kind": kind,
+                "data": base64.urlsafe_b64encode(json.dumps(data).encode())
+            })
+
+        returned: str = resp.content.decode("utf-8")
+        if returned == UNAUTHORIZED:
+            tc.print_fail(f"Could not send {kind}: {returned}")
+
+        elif resp.ok:
+            self._synced(kind, data)
+
+        else:
+            tc.print_fail(f"Could not send {kind}: {resp.status_code} {returned}")
+
+        self._save_state()
+        return returned
+
+    def _post(self, url: str, body: dict) -> Response | None:
+        """Posts a compressed protocol request.
+
+        Returns:
+            The response, or None if the server did not answer in the protocol. A wrong password is
+            answered the same way by either kind of server, so that response is returned as is.
+        """
+        raw: bytes = json.dumps(body, separators=(",", ":")).encode()
+        compressed: bytes = zlib.compress(raw, 6)
+        resp: Response = self.session.post(url, data=compressed, timeout=self.timeout, headers={
+            "Content-Type": "application/json",
+            "Content-Encoding": "deflate",
+        })
+
+        if resp.text == UNAUTHORIZED:
+            return resp
+
+        try:
+            reply: object = resp.json()
+
+        except ValueError:
+            return None
+
+        if not isinstance(reply, dict) or reply.get("protocol") != PROTOCOL:
+            return None
+
+        tc.print_ok(f"Sent {body['kind']} {'delta' if 'delta' in body else 'in full'}: "
+                    f"{len(compressed)} bytes ({len(raw)} uncompressed)")
+        return resp
+
+
+_client: SyncClient | None = None
+
+
+def sync_client() -> SyncClient:
+    """Returns the shared sync client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = SyncClient()
+
+    return _client
+
+
+def _pull(pwd: str) -> None:
+    """Retrieves data from AWS and stores it in local files.
+
+    Args:
+        pwd: The password to authenticate with the AWS endpoint.
+    """
+    sync_client().pull(pwd)
 
 
 def _push(data: dict, kind: str, pwd: str) -> str:
@@ -46,25 +286,17 @@ def _push(data: dict, kind: str, pwd: str) -> str:
     Returns:
         The response content from the AWS endpoint.
     """
-
-    params: dict = {
-        "pass": sha256(pwd.encode()).hexdigest(),
-        "kind": kind,
-        "data": base64.urlsafe_b64encode(json.dumps(data).encode())
-    }
-
-    resp: Response = requests.post("https://i5nqbfht5a6v4epzr5anistot40qkyaz.lambda-url.ca-central-1.on.aws/",
-                                   data=params
-                                   )
-    return resp.content.decode("utf-8")
+    return sync_client().push(kind, data, pwd)
 
 
 def handle_sync() -> None:
     """Prompts the user to synchronize with AWS."""
-
     if input("Sync local machine with AWS? (y/n) ").lower() == "y":
         aws_key: str = pwinput()
         _pull(aws_key)
+
+        # Reopening the validation store imports the downloaded validation.json
+        validation.close()
         print("Finished syncing local machine")
 
     if input("Sync AWS with local machine? (y/n) ").lower() == "y":
@@ -72,7 +304,6 @@ def handle_sync() -> None:
         with open("resources/data/api_key.json", "r") as api:
             _push(json.load(api), "apikey", aws_key)
 
-        with open("resources/data/validation.json", "r") as val:
-            _push(json.load(val), "validation", aws_key)
-
+        # validation.json is only an export of the validation store, bring it up to date first
+        _push(validation.export_json(), "validation", aws_key)
         print("Finished syncing AWS")
@@ -0,0 +1,151 @@
+import numpy as np
+
+
+def _intervals(cols: dict[str, np.ndarray], now: float) -> tuple[np.ndarray, ...]:
+    """Orders the scans by device and time and finds when each one was followed by the device's next scan.
+
+    Args:
+        cols: History columns from History.columns.
+        now: The time used as the end of a device's last scan.
+
+    Returns:
+        The sort order, the sorted device codes, scan times, OUT flags, end times, and a mask of each device's last scan.
+    """
+    order: np.ndarray = np.lexsort((cols["ts"], cols["device"]))
+    device: np.ndarray = cols["device"][order]
+    ts: np.ndarray = cols["ts"][order]
+    out: np.ndarray = cols["out"][order]
+
+    last: np.ndarray = np.ones(len(device), dtype=bool)
+    last[:-1] = device[1:] != device[:-1]
+    ends: np.ndarray = np.empty_like(ts)
+    ends[:-1] = ts[1:]
+    ends[last] = now
+    return order, device, ts, out, ends, last
+
+
+def time_out(cols: dict[str, np.ndarray], now: float) -> list[dict]:
+    """Totals how long each device has spent rented out.
+
+    A device is out from an OUT scan until its next scan, or until now if that is its last scan.
+
+    Args:
+        cols: History columns from History.columns.
+        now: The current time in epoch seconds.
+
+    Returns:
+        One record per device with its total seconds out, number of rentals and whether it is out now,
+        longest total first.
+    """
+    if len(cols["ts"]) == 0:
+        return []
+
+    _, device, ts, out, ends, last = _intervals(cols, now)
+    seconds: np.ndarray = np.bincount(device, weights=np.where(out, ends - ts, 0.0), minlength=len(cols["devices"]))
+    rentals: np.ndarray = np.bincount(device, weights=out, minlength=len(cols["devices"])).astype(np.int64)
+    is_out: np.ndarray = np.zeros(len(cols["devices"]), dtype=bool)
+    is_out[device[last]] = out[last]
+
+    return [
+        {"device": str(cols["devices"][i]), "seconds_out": float(seconds[i]), "rentals": int(rentals[i]),
+         "out_now": bool(is_out[i])}
+        for i in np.argsort(-seconds, kind="stable") if rentals[i] > 0
+    ]
+
+
+def overdue(cols: dict[str, np.ndarray], now: float, days: float) -> list[dict]:
+    """Lists devices that are out and were rented more than the given number of days ago.
+
+    Args:
+        cols: History columns from History.columns.
+        now: The current time in epoch seconds.
+        days: How long a rental may last.
+
+    Returns:
+        One record per overdue device with who has it and since when, longest overdue first.
+    """
+    if len(cols["ts"]) == 0:
+        return []
+
+    order, _, ts, out, _, last = _intervals(cols, now)
+    late: np.ndarray = last & out & (now - ts > days * 86400)
+    rows: np.ndarray = order[late]
+    rows = rows[np.argsort(cols["ts"][rows], kind="stable")]
+
+    return [
+        {"device": str(cols["devices"][cols["device"][i]]), "student": str(cols["students"][cols["student"][i]]),
+         "category": str(cols["categories"][cols["category"][i]]), "since": float(cols["ts"][i]),
+         "days_out": float((now - cols["ts"][i]) / 86400)}
+        for i in rows
+    ]
+
+
+def utilization(cols: dict[str, np.ndarray], start: float, end: float) -> list[dict]:
+    """Finds the share of device time each category spent rented out over a period.
+
+    Only devices that appear in the history are counted.
+
+    Args:
+        cols: History columns from History.columns.
+        start: Start of the period in epoch seconds.
+        end: End of the period in epoch seconds.
+
+    Returns:
+        One record per category with its device count, device hours out and utilization between 0 and 1.
+    """
+    if len(cols["ts"]) == 0 or end <= start:
+        return []
+
+    order, device, ts, out, ends, _ = _intervals(cols, end)
+    category: np.ndarray = cols["category"][order]
+    overlap: np.ndarray = np.clip(np.minimum(ends, end) - np.maximum(ts, start), 0.0, None)
+    seconds: np.ndarray = np.bincount(category, weights=np.where(out, overlap, 0.0), minlength=len(cols["categories"]))
+
+    # Devices are counted once per category they were scanned under
+    seen: np.ndarray = np.zeros((len(cols["categories"]), len(cols["devices"])), dtype=bool)
+    seen[category, device] = True
+    devices: np.ndarray = seen.sum(axis=1)
+
+    return [
+        {"category": str(cols["categories"][i]), "devices": int(devices[i]), "hours_out": float(seconds[i] / 3600),
+         "utilization": float(seconds[i] / (devices[i] * (end - start)))}
+        for i in range(len(cols["categories"])) if devices[i] > 0
+    ]
+
+
+def per_student(cols: dict[str, np.ndarray], now: float) -> list[dict]:
+    """Counts rentals per student and how many devices each student has out now.
+
+    Args:
+        cols: History columns from History.columns.
+        now: The current time in epoch seconds.
+
+    Returns:
+        One record per student, most rentals first.
+    """
+    if len(cols["ts"]) == 0:
+        return []
+
+    order, _, _, out, _, last = _intervals(cols, now)
+    rentals: np.ndarray = np.bincount(cols["student"][cols["out"]], minlength=len(cols["students"]))
+    holding: np.ndarray = np.bincount(cols["student"][order[last & out]], minlength=len(cols["students"]))
+
+    return [
+        {"student": str(cols["students"][i]), "rentals": int(rentals[i]), "holding": int(holding[i])}
+        for i in np.argsort(-rentals, kind="stable") if rentals[i] > 0
+    ]
+
+
+def peak_hours(cols: dict[str, np.ndarray]) -> list[dict]:
+    """Counts rentals and returns per hour of the day.
+
+    Args:
+        cols: History columns from History.columns.
+
+    Returns:
+        One record per hour from 0 to 23.
+    """
+    hour: np.ndarray = cols["hour"].astype(np.int64)
+    rentals: np.ndarray = np.bincount(hour[cols["out"]], minlength=24)
+    returns: np.ndarray = np.bincount(hour[~cols["out"]], minlength=24)
+    return [{"hour": h, "rentals": int(rentals[h]), "returns": int(returns[h])} for h in range(24)]
@@ -0,0 +1,137 @@
+import time
+import numpy as np
+import threading as th
+from collections import deque
+from resources.scripts.Metrics import metrics
+from resources.scripts.Sources import FrameSource, CameraSource
+from resources.scripts.TermColor import TermColor
+
+tc = TermColor()
+
+
+class Camera:
+    def __init__(self, source: FrameSource | int = 0, buffer_size: int = 4, open_timeout: float = 5.0,
+                 realtime: bool = True):
+        """Initializes a long-lived camera that grabs frames on a background thread.
+
+        Args:
+            source: Where frames come from, or the index of a camera device.
+            buffer_size: How many of the most recent frames to keep in the ring buffer.
+            open_timeout: Seconds to wait for the first frame before the camera is considered failed.
+            realtime: Whether recorded and generated sources are replayed at the rate they were made at.
+                Otherwise each frame is produced as soon as the previous one has been taken, so none are
+                skipped and the scanner sets the pace. Live cameras always run at their own rate.
+        """
+        self.source: FrameSource = CameraSource(source) if isinstance(source, int) else source
+        self.realtime: bool = realtime or self.source.live
+        self.open_timeout: float = open_timeout
+        self.frames: deque[tuple[int, np.ndarray]] = deque(maxlen=buffer_size)
+        self.frame_id: int = 0
+        self.taken_id: int = 0
+        self.failed: bool = False
+        self.ended: bool = False
+        self.started_at: float = 0.0
+        self.lock: th.Lock = th.Lock()
+        self.running: th.Event = th.Event()
+        self.taken: th.Event = th.Event()
+        self.thread: th.Thread | None = None
+
+    def start(self) -> "Camera":
+        """Opens the device and starts the capture thread if it is not already running.
+
+        Returns:
+            The camera itself so it can be created and started in one line.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return self
+
+        self.failed = not self.source.open()
+        self.ended = False
+        self.started_at = time.monotonic()
+        if self.failed:
+            tc.print_fail(f"Could not open {self.source.name}")
+            return self
+
+        self.running.set()
+        self.taken.set()
+        self.thread = th.Thread(target=self._capture, name=self.source.name.replace(" ", "-"), daemon=True)
+        self.thread.start()
+        return self
+
+    def _capture(self) -> None:
+        """Grabs frames into the ring buffer until stopped or the source stops returning frames."""
+        interval: float = 1.0 / self.source.fps if not self.source.live and self.source.fps > 0 else 0.0
+        due: float = time.monotonic()
+        while self.running.is_set():
+            # As fast as possible still means one frame at a time, the next is only made once this one is taken
+            if not self.realtime:
+                if not self.taken.wait(0.1):
+                    continue
+
+                self.taken.clear()
+
+            with metrics.timer("camera.read"):
+                frame: np.ndarray | None = self.source.read()
+
+            if frame is None:
+                self.ended = not self.source.live
+                self.failed = True
+                break
+
+            # Recordings are held back to the rate they were made at, without catching up after a stall
+            if self.realtime and interval > 0:
+                due += interval
+                delay: float = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                else:
+                    due = time.monotonic()
+
+            with self.lock:
+                self.frame_id += 1
+                self.frames.append((self.frame_id, frame))
+
+        self.running.clear()
+        self.source.close()
+
+    def latest(self) -> tuple[int, np.ndarray | None]:
+        """Returns the freshest frame without waiting for the camera.
+
+        Returns:
+            A tuple of the frame's sequence number and the frame, or (0, None) if no frame is available yet.
+        """
+        with self.lock:
+            if len(self.frames) == 0:
+                return 0, None
+
+            if self.taken_id != self.frame_id:
+                self.taken_id = self.frame_id
+                self.taken.set()
+
+            return self.frames[-1]
+
+    def is_failed(self) -> bool:
+        """Checks whether the camera has stopped producing frames.
+
+        Returns:
+            True if the source could not be opened, stopped returning frames (see ended for
+            recordings that simply finished), or never produced a frame within the open timeout.
+        """
+        if self.failed:
+            return True
+
+        return self.frame_id == 0 and time.monotonic() - self.started_at > self.open_timeout
+
+    def release(self) -> None:
+        """Stops the capture thread and releases the device."""
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+            self.thread = None
+
+        else:
+            self.source.close()
+
+        with self.lock:
+            self.frames.clear()
@@ -0,0 +1,313 @@
+import os
+import cv2
+import time
+import queue
+import numpy as np
+import threading as th
+from concurrent.futures import ThreadPoolExecutor
+from resources.scripts.Metrics import metrics
+
+
+class ChangeGate:
+    def __init__(self, threshold: float = 4.0, settle: float = 1.0, idle_interval: float = 1.0,
+                 size: tuple[int, int] = (64, 48)):
+        """Initializes a cheap check of whether a frame is worth decoding.
+
+        Frames are compared to the previous one on a tiny grayscale thumbnail. Everything is decoded
+        while the scene moves and for a moment after it settles, since a card being held up is
+        usually sharpest once it stops. A still scene is only decoded every so often, and not at all
+        once a code has been read from it, because it would only decode the same code again.
+
+        Args:
+            threshold: Mean absolute difference between thumbnails, out of 255, that counts as movement.
+            settle: Seconds to keep decoding after the last movement.
+            idle_interval: Seconds between decodes of a still scene no code was read from.
+            size: The (width, height) of the thumbnails compared.
+        """
+        self.threshold: float = threshold
+        self.settle: float = settle
+        self.idle_interval: float = idle_interval
+        self.small: np.ndarray = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self.current: np.ndarray = np.empty((size[1], size[0]), dtype=np.uint8)
+        self.previous: np.ndarray | None = None
+        self.diff: np.ndarray = np.empty_like(self.current)
+        self.last_motion: float = 0.0
+        self.last_decode: float = 0.0
+        self.found_at: float = -1.0
+        self.passed: int = 0
+        self.skipped: int = 0
+
+    def check(self, frame: np.ndarray) -> bool:
+        """Decides whether a frame should be decoded. Must be called for every frame, in order.
+
+        Args:
+            frame: The BGR camera frame.
+
+        Returns:
+            True if the frame should be decoded.
+        """
+        now: float = time.monotonic()
+        cv2.resize(frame, self.small.shape[1::-1], dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.current)
+        if self.previous is None:
+            self.previous = np.empty_like(self.current)
+            self.last_motion = now
+
+        elif cv2.mean(cv2.absdiff(self.current, self.previous, dst=self.diff))[0] > self.threshold:
+            self.last_motion = now
+
+        self.current, self.previous = self.previous, self.current
+
+        if now - self.last_motion < self.settle:
+            decode: bool = True
+
+        # A code was read since the scene last moved, so it is still the one in view
+        elif self.found_at >= self.last_motion:
+            decode = False
+
+        else:
+            decode = now - self.last_decode >= self.idle_interval
+
+        if decode:
+            self.last_decode = now
+            self.passed += 1
+
+        else:
+            self.skipped += 1
+
+        return decode
+
+    def found(self, checked_at: float) -> None:
+        """Records that a code was read from a frame that passed the gate.
+
+        Args:
+            checked_at: When the frame was checked, as returned by time.monotonic.
+        """
+        self.found_at = max(self.found_at, checked_at)
+
+
+class DecodePipeline:
+    def __init__(self, workers: int | None = None, scale: float = 0.5, roi_margin: int = 60, gate: bool = True,
+                 multi: bool = False):
+        """Initializes a pool of QR decoders that run off the UI thread.
+
+        Args:
+            workers: Number of decode threads. Defaults to one less than the number of cores.
+            scale: Factor used to downscale frames for the first, cheap decode attempt.
+            roi_margin: Pixels of padding around the last detected code when decoding a region of interest.
+            gate: Whether to skip frames where nothing changed. See ChangeGate.
+            multi: Whether to look for every code in a frame. Codes found together are also posted
+                as one group, see poll_groups.
+        """
+        self.workers: int = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.scale: float = scale
+        self.roi_margin: int = roi_margin
+        self.pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decode")
+        self.multi: bool = multi
+        self.results: queue.Queue[tuple[int, str, np.ndarray]] = queue.Queue()
+        self.groups: queue.Queue[tuple[int, tuple[str, ...]]] = queue.Queue()
+        self.local: th.local = th.local()
+        self.lock: th.Lock = th.Lock()
+        self.in_flight: int = 0
+        self.generation: int = 0
+        self.last_points: np.ndarray | None = None
+        self.gate: ChangeGate | None = ChangeGate() if gate else None
+
+    def _decoder(self) -> cv2.QRCodeDetector:
+        """Returns this thread's decoder. QRCodeDetector is not safe to share between threads."""
+        if not hasattr(self.local, "decoder"):
+            self.local.decoder = cv2.QRCodeDetector()
+
+        return self.local.decoder
+
+    def warm_up(self, size: tuple[int, int] = (640, 480), timeout: float = 10.0) -> "DecodePipeline":
+        """Starts every worker and runs its decoder once so the first scan does not pay for it.
+
+        Args:
+            size: The (width, height) of the blank frame decoded.
+            timeout: Seconds to wait for the workers.
+
+        Returns:
+            The pipeline, so warming it up on an executor hands back the ready pipeline.
+        """
+        blank: np.ndarray = np.full((size[1], size[0]), 255, dtype=np.uint8)
+
+        # Each task waits for all the others, so every worker thread takes exactly one
+        ready: th.Barrier = th.Barrier(self.workers)
+
+        def warm() -> None:
+            try:
+                ready.wait(timeout)
+
+            except th.BrokenBarrierError:
+                pass
+
+            if self.multi:
+                self._decoder().detectAndDecodeMulti(blank)
+
+            else:
+                self._decoder().detectAndDecode(blank)
+
+        for future in [self.pool.submit(warm) for _ in range(self.workers)]:
+            future.result(timeout)
+
+        return self
+
+    def submit(self, frame: np.ndarray) -> bool:
+        """Queues a frame for decoding if it passes the change gate and a worker is free.
+
+        Args:
+            frame: The BGR camera frame. It must not be modified after submission.
+
+        Returns:
+            True if the frame was queued, False if it was skipped or every worker is busy.
+        """
+        if self.gate is not None and not self.gate.check(frame):
+            metrics.count("decode.skipped")
+            return False
+
+        checked_at: float = self.gate.last_decode if self.gate is not None else time.monotonic()
+
+        with self.lock:
+            if self.in_flight >= self.workers:
+                metrics.count("decode.dropped")
+                return False
+
+            self.in_flight += 1
+            generation: int = self.generation
+
+        self.pool.submit(self._decode, generation, frame, checked_at)
+        return True
+
+    def _decode(self, generation: int, frame: np.ndarray, checked_at: float) -> None:
+        """Decodes one frame and posts any result to the results queue."""
+        try:
+            with metrics.timer("decode"):
+                found: dict[str, np.ndarray] = self.detect_multi(frame) if self.multi else dict([self.detect(frame)])
+
+            found.pop("", None)
+            if len(found) > 0:
+                metrics.count("decode.found", len(found))
+                if self.gate is not None:
+                    self.gate.found(checked_at)
+
+            for text, points in found.items():
+                self.last_points = points
+                self.results.put((generation, text, points))
+
+            if len(found) > 1:
+                self.groups.put((generation, tuple(found)))
+
+        except cv2.error:
+            pass
+
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def detect(self, frame: np.ndarray) -> tuple[str, np.ndarray | None]:
+        """Tries a downscaled frame, then the area around the last code, then the full frame.
+
+        Args:
+            frame: The BGR camera frame.
+
+        Returns:
+            The decoded text (empty if nothing was found) and the code's corners in full resolution coordinates.
+        """
+        decoder: cv2.QRCodeDetector = self._decoder()
+        gray: np.ndarray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        small: np.ndarray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        text, points, _ = decoder.detectAndDecode(small)
+        if text != "" and points is not None:
+            return text, points / self.scale
+
+        last_points: np.ndarray | None = self.last_points
+        if last_points is not None:
+            x, y, w, h = cv2.boundingRect(last_points.reshape(-1, 2).astype(np.int32))
+            x0, y0 = max(x - self.roi_margin, 0), max(y - self.roi_margin, 0)
+            x1, y1 = min(x + w + self.roi_margin, gray.shape[1]), min(y + h + self.roi_margin, gray.shape[0])
+            if x1 > x0 and y1 > y0:
+                text, points, _ = decoder.detectAndDecode(gray[y0:y1, x0:x1])
+                if text != "" and points is not None:
+                    return text, points + np.array([x0, y0], dtype=points.dtype)
+
+        text, points, _ = decoder.detectAndDecode(gray)
+        return text, points
+
+    def detect_multi(self, frame: np.ndarray) -> dict[str, np.ndarray]:
+        """Finds every code in a frame, trying a downscaled frame and, unless it had two, the full one.
+
+        Args:
+            frame: The BGR camera frame.
+
+        Returns:
+            Each decoded text mapped to its code's corners in full resolution coordinates.
+        """
+        decoder: cv2.QRCodeDetector = self._decoder()
+        gray: np.ndarray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        small: np.ndarray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        found: dict[str, np.ndarray] = {}
+        ok, texts, points, _ = decoder.detectAndDecodeMulti(small)
+        if ok:
+            found.update((text, corners / self.scale) for text, corners in zip(texts, points) if text != "")
+
+        # Dense codes, like hashed student IDs, often only decode at full resolution
+        if len(found) < 2:
+            ok, texts, points, _ = decoder.detectAndDecodeMulti(gray)
+            if ok:
+                found.update((text, corners) for text, corners in zip(texts, points) if text != "")
+
+        return found
+
+    def poll_groups(self) -> list[tuple[str, ...]]:
+        """Drains the codes found together in one frame without blocking. Only used with multi.
+
+        Returns:
+            The codes of each frame with more than one, from frames submitted since the last reset, oldest first.
+        """
+        found: list[tuple[str, ...]] = []
+        while True:
+            try:
+                generation, texts = self.groups.get_nowait()
+
+            except queue.Empty:
+                return found
+
+            if generation == self.generation:
+                found.append(texts)
+
+    def idle(self) -> bool:
+        """Checks whether no frames are being decoded."""
+        with self.lock:
+            return self.in_flight == 0
+
+    def poll(self) -> list[str]:
+        """Drains decoded results without blocking.
+
+        Returns:
+            The decoded strings from frames submitted since the last reset, oldest first.
+        """
+        found: list[str] = []
+        while True:
+            try:
+                generation, text, _ = self.results.get_nowait()
+
+            except queue.Empty:
+                return found
+
+            if generation == self.generation:
+                found.append(text)
+
+    def reset(self) -> None:
+        """Discards pending results, including ones from decodes still running for the previous prompt."""
+        with self.lock:
+            self.generation += 1
+
+        self.poll()
+        self.poll_groups()
+
+    def close(self) -> None:
+        """Stops the worker pool, dropping any queued frames."""
+        self.pool.shutdown(wait=False, cancel_futures=True)
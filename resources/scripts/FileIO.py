@@ -1,6 +1,4 @@
 import json
-from pwinput import pwinput
-from resources.scripts.AWS import _pull
 from resources.scripts.Logging import write_log
 from resources.scripts.TermColor import TermColor
 from resources.scripts.Exceptions import StopExecution
@@ -30,6 +28,10 @@ def read(path: str, exit_on_error: bool = True) -> dict[str, str] | list[str] |
                     tc.format("[HELP]", "help") + " Sync local machine with version stored in cloud? (y/n) "
             ) in ["y", "yes"]:
                 tc.print_help("Starting sync tool")
+
+                # Imported here since this rare case is the only one that needs the sync tool
+                from pwinput import pwinput
+                from resources.scripts.AWS import _pull
                 aws_key: str = pwinput()
                 _pull(aws_key)
                 tc.print_ok("Downloaded keys. Please restart the program.")
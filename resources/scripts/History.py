@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import threading as th
+import numpy as np
+
+
+class History:
+    def __init__(self, path: str, cache: str | None = None):
+        """Initializes the local, append-only history of every scan.
+
+        Scans are appended as NDJSON lines. For reports they are turned into columns of codes and
+        timestamps, which are cached in an .npz file next to the history so only lines appended
+        since the last report have to be parsed.
+
+        Args:
+            path: The NDJSON history file.
+            cache: The column cache. Defaults to the history path with an .npz extension.
+        """
+        self.path: str = path
+        self.cache: str = cache or f"{os.path.splitext(path)[0]}.npz"
+        self.lock: th.Lock = th.Lock()
+
+    def append(self, entry: dict[str, str]) -> None:
+        """Appends a scan.
+
+        Args:
+            entry: The scan, as built by Writer.make_entry.
+        """
+        line: str = json.dumps({**entry, "ts": round(time.time(), 3)}, separators=(",", ":")) + "\n"
+        with self.lock, open(self.path, "a") as f:
+            f.write(line)
+
+    def columns(self) -> dict[str, np.ndarray]:
+        """Loads the history as columns, parsing only what was appended since the cache was written.
+
+        Returns:
+            "ts" (epoch seconds), "hour" (local hour of the scan), "out" (True for OUT), and "device",
+            "student" and "category" as integer codes into the "devices", "students" and "categories"
+            arrays of names. Rows are in the order they were scanned.
+        """
+        cols: dict[str, np.ndarray] = {
+            "ts": np.empty(0, dtype=np.float64), "hour": np.empty(0, dtype=np.int8), "out": np.empty(0, dtype=bool),
+            "device": np.empty(0, dtype=np.int32), "student": np.empty(0, dtype=np.int32),
+            "category": np.empty(0, dtype=np.int32),
+            "devices": np.empty(0, dtype=str), "students": np.empty(0, dtype=str), "categories": np.empty(0, dtype=str),
+        }
+        offset: int = 0
+        try:
+            with np.load(self.cache) as cached:
+                cols.update({key: cached[key] for key in cols})
+                offset = int(cached["offset"])
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+        try:
+            with open(self.path, "rb") as f:
+                if os.path.getsize(self.path) < offset:
+                    offset = 0  # The history was replaced, start over
+                    cols = {key: value[:0] for key, value in cols.items()}
+
+                f.seek(offset)
+                data: bytes = f.read()
+
+        except FileNotFoundError:
+            return cols
+
+        # A scan being appended right now is left for the next report
+        data = data[:data.rfind(b"\n") + 1]
+        if len(data) == 0:
+            return cols
+
+        vocab: dict[str, dict[str, int]] = {
+            name: {value: i for i, value in enumerate(cols[name].tolist())} for name in ("devices", "students", "categories")
+        }
+        ts: list[float] = []
+        hour: list[int] = []
+        out: list[bool] = []
+        codes: dict[str, list[int]] = {"device": [], "student": [], "category": []}
+        for line in data.splitlines():
+            try:
+                entry: dict = json.loads(line)
+
+            except ValueError:
+                continue
+
+            ts.append(entry["ts"])
+            hour.append(int(entry["time"].split(":")[0]))
+            out.append(entry["action"] == "OUT")
+            for column, names in (("device", "devices"), ("student", "students"), ("category", "categories")):
+                codes[column].append(vocab[names].setdefault(entry.get(column, ""), len(vocab[names])))
+
+        cols["ts"] = np.concatenate([cols["ts"], np.array(ts, dtype=np.float64)])
+        cols["hour"] = np.concatenate([cols["hour"], np.array(hour, dtype=np.int8)])
+        cols["out"] = np.concatenate([cols["out"], np.array(out, dtype=bool)])
+        for column, names in (("device", "devices"), ("student", "students"), ("category", "categories")):
+            cols[column] = np.concatenate([cols[column], np.array(codes[column], dtype=np.int32)])
+            cols[names] = np.array(list(vocab[names]), dtype=str)
+
+        with open(f"{self.cache}.tmp", "wb") as f:
+            np.savez(f, offset=offset + len(data), **cols)
+
+        os.replace(f"{self.cache}.tmp", self.cache)
+        return cols
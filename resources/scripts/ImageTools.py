@@ -1,6 +1,5 @@
 import cv2
 import numpy as np
-from PIL import ImageDraw, ImageFont, Image
 
 
 def add_text_f(img_path: str, text: str) -> np.array:
@@ -13,6 +12,9 @@ def add_text_f(img_path: str, text: str) -> np.array:
     Returns:
         A NumPy array containing the image with the added text.
     """
+    # Pillow is only needed here, the preview is drawn with OpenCV
+    from PIL import ImageDraw, ImageFont, Image
+
     img: Image = Image.fromarray(cv2.imread(img_path))  # Don't want to use context manager lol
     font: ImageFont = ImageFont.truetype("resources/data/RobotoMono-Regular.ttf", size=16)
     artist: ImageDraw = ImageDraw.Draw(img)
@@ -40,3 +42,95 @@ def add_text(img: np.ndarray, text: str, loc: tuple[int] | list[int]) -> np.ndar
         thickness=2,
         lineType=cv2.LINE_8
     )
+
+
+class PreviewRenderer:
+    def __init__(self):
+        """Initializes the scanner preview renderer.
+
+        Output frames are written into one preallocated buffer. The instructions header is rendered
+        once per prompt and the feedback banner once per message, into a buffer reused while the
+        window width stays the same, so drawing a frame does not allocate.
+        """
+        self.scaled: np.ndarray | None = None
+        self.out: np.ndarray | None = None
+        self.headers: dict[tuple, np.ndarray] = {}
+        self.banner: tuple[tuple, np.ndarray] | None = None
+        self.stats: tuple[tuple[str, ...], np.ndarray] | None = None
+
+    def _header(self, message: str, source: tuple[int, int], size: tuple[int, int]) -> np.ndarray:
+        """Returns the instructions header scaled the same way as the camera frame under it."""
+        key: tuple = (message, source, size)
+        if key not in self.headers:
+            header: np.ndarray = np.full((75, 225, 3), 255, dtype=np.uint8)
+            add_text(header, message, [10, 30])
+            add_text(header, "Press 'q' to quit", [10, 60])
+            width: int = max(1, round(225 * size[0] / source[0]))
+            height: int = max(1, round(75 * size[1] / source[1]))
+            self.headers[key] = cv2.resize(header, (width, height), interpolation=cv2.INTER_AREA)
+
+        return self.headers[key]
+
+    def _banner(self, text: str, error: bool, width: int) -> np.ndarray:
+        """Returns the feedback banner drawn across the bottom of the preview, redrawn only when it changes.
+
+        Messages name students and devices, so only the current banner is kept.
+        """
+        key: tuple = (text, error, width)
+        if self.banner is None or self.banner[0] != key:
+            banner: np.ndarray = self.banner[1] if self.banner is not None and self.banner[0][2] == width \
+                else np.empty((50, width, 3), dtype=np.uint8)
+            banner[:] = (80, 80, 230) if error else (120, 220, 120)
+            self.banner = (key, add_text(banner, text, [10, 33]))
+
+        return self.banner[1]
+
+    def _stats(self, lines: tuple[str, ...], height: int) -> np.ndarray:
+        """Returns the stats panel, rebuilt only when its text changes."""
+        if self.stats is None or self.stats[0] != lines:
+            shown: tuple[str, ...] = lines[:max(0, (height - 10) // 16)]
+            panel: np.ndarray = np.zeros((len(shown) * 16 + 10, 440, 3), dtype=np.uint8)
+            for i, line in enumerate(shown):
+                cv2.putText(panel, line, (6, 18 + 16 * i), cv2.FONT_HERSHEY_PLAIN, 1.0, (255, 255, 255), 1, cv2.LINE_8)
+
+            self.stats = (lines, panel)
+
+        return self.stats[1]
+
+    def render(self, raw_frame: np.ndarray, message: str, size: tuple[int, int],
+               notice: tuple[str, bool] | None = None, stats: tuple[str, ...] | None = None) -> np.ndarray:
+        """Builds the mirrored preview frame with the instructions header.
+
+        Args:
+            raw_frame: The camera frame.
+            message: The prompt shown in the header.
+            size: The (width, height) of the scanner window.
+            notice: An optional feedback message and whether it reports a problem.
+            stats: Optional lines of stage metrics shown under the header.
+
+        Returns:
+            The frame to show. It is overwritten by the next call.
+        """
+        if self.out is None or self.out.shape[1::-1] != size:
+            self.scaled = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.out = np.empty_like(self.scaled)
+
+        # Scaling before mirroring flips the smaller image, the result is the same
+        cv2.resize(raw_frame, size, dst=self.scaled, interpolation=cv2.INTER_AREA)
+        cv2.flip(self.scaled, 1, dst=self.out)
+
+        header: np.ndarray = self._header(message, raw_frame.shape[1::-1], size)
+        h, w = min(header.shape[0], size[1]), min(header.shape[1], size[0])
+        self.out[:h, :w] = header[:h, :w]
+
+        if stats is not None:
+            panel: np.ndarray = self._stats(stats, size[1] - h - 50)
+            ph, pw = min(panel.shape[0], size[1] - h), min(panel.shape[1], size[0])
+            self.out[h:h + ph, :pw] = panel[:ph, :pw]
+
+        if notice is not None:
+            banner: np.ndarray = self._banner(notice[0], notice[1], size[0])
+            h = min(banner.shape[0], size[1])
+            self.out[size[1] - h:] = banner[banner.shape[0] - h:]
+
+        return self.out
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import threading as th
+from collections import deque
+from resources.scripts.TermColor import TermColor
+
+tc = TermColor()
+
+
+class Journal:
+    def __init__(self, path: str, sync_every: int = 8, sync_interval: float = 1.0):
+        """Initializes an append-only, crash-durable journal of scan entries.
+
+        Every entry is written as one JSON line tagged with a sequence number. Acknowledging
+        entries writes an ack line, after which the journal is compacted down to whatever is
+        still pending. Appends are only written and flushed to the OS. Every fsync runs on the
+        journal-sync thread, after sync_every appends or once sync_interval seconds have passed
+        since the first unsynced append, whichever comes first, so scans never wait on the disk.
+
+        Args:
+            path: Where to keep the journal file.
+            sync_every: Number of appends that forces an fsync.
+            sync_interval: Longest time in seconds an append may sit in the OS buffers.
+        """
+        self.path: str = path
+        self.sync_every: int = sync_every
+        self.sync_interval: float = sync_interval
+        self.lock: th.Lock = th.Lock()
+        self.compacting: th.Lock = th.Lock()
+        self.unacked: deque[tuple[int, dict[str, str]]] = deque()
+        self.sequence: int = 0
+        self.unsynced: int = 0
+        self.first_unsynced: float = 0.0
+        self.closed: th.Event = th.Event()
+        self.wake: th.Event = th.Event()
+
+        self._load()
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.syncer: th.Thread = th.Thread(target=self._sync_loop, name="journal-sync", daemon=True)
+        self.syncer.start()
+
+    def _load(self) -> None:
+        """Reads the existing journal, if any, to find entries that were never acknowledged."""
+        if not os.path.exists(self.path):
+            return
+
+        acked: int = 0
+        good_bytes: int = 0
+        entries: list[tuple[int, dict[str, str]]] = []
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record: dict = json.loads(line)
+
+                # A torn final line means we crashed mid-write, everything before it is intact
+                except json.JSONDecodeError:
+                    tc.print_warning(f"Dropping partial record at end of {self.path}")
+                    break
+
+                good_bytes += len(line)
+                if "ack" in record:
+                    acked = max(acked, record["ack"])
+
+                else:
+                    entries.append((record["seq"], record["entry"]))
+                    self.sequence = max(self.sequence, record["seq"])
+
+        # Cut off the torn record so new appends start on a clean line
+        if good_bytes < os.path.getsize(self.path):
+            os.truncate(self.path, good_bytes)
+
+        self.unacked.extend((seq, entry) for seq, entry in entries if seq > acked)
+
+    def replay(self) -> list[dict[str, str]]:
+        """Returns the entries that were journaled but never acknowledged, oldest first.
+
+        Returns:
+            A copy of the pending entries.
+        """
+        with self.lock:
+            return [entry for _, entry in self.unacked]
+
+    def append(self, entry: dict[str, str]) -> int:
+        """Journals a scan entry.
+
+        Args:
+            entry: The entry to persist.
+
+        Returns:
+            The sequence number given to the entry.
+        """
+        with self.lock:
+            self.sequence += 1
+            self.unacked.append((self.sequence, entry))
+            self.file.write(json.dumps({"seq": self.sequence, "entry": entry}, separators=(",", ":")) + "\n")
+            self.file.flush()
+            self._unsynced(1)
+            return self.sequence
+
+    def ack(self, count: int, requeue: list[dict[str, str]] | None = None) -> None:
+        """Marks the oldest pending entries as stored and compacts the journal.
+
+        Args:
+            count: How many of the oldest pending entries were handed to the sheet.
+            requeue: Entries among those that failed to write. They stay pending, ahead of newer entries.
+        """
+        requeue = requeue or []
+        with self.compacting:
+            with self.lock:
+                count = min(count, len(self.unacked))
+                if count == 0:
+                    return
+
+                for _ in range(count - 1):
+                    self.unacked.popleft()
+
+                seq, _ = self.unacked.popleft()
+
+                # Requeued entries get fresh records before the ack so a crash mid-compaction cannot lose them
+                retried: list[tuple[int, dict[str, str]]] = []
+                for entry in requeue:
+                    self.sequence += 1
+                    retried.append((self.sequence, entry))
+                    self.file.write(json.dumps({"seq": self.sequence, "entry": entry}, separators=(",", ":")) + "\n")
+
+                self.file.write(json.dumps({"ack": seq}) + "\n")
+                self.unacked.extendleft(reversed(retried))
+                pending: list[tuple[int, dict[str, str]]] = list(self.unacked)
+
+            # Called from the writer thread, so syncing here holds up nothing but the next flush
+            self._sync()
+            self._compact(pending)
+
+    def _compact(self, pending: list[tuple[int, dict[str, str]]]) -> None:
+        """Rewrites the journal so it only holds pending entries. Must be called with the compacting lock held.
+
+        The pending entries are written and synced without the lock appends take. Anything appended
+        meanwhile is copied over under the lock just before the new file replaces the old one.
+        Entries are renumbered in queue order, the compacted file holds no acks so numbering restarts.
+
+        Args:
+            pending: The entries that were pending when the acknowledgement was written.
+        """
+        tmp_path: str = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as tmp:
+            for seq, (_, entry) in enumerate(pending, start=1):
+                tmp.write(json.dumps({"seq": seq, "entry": entry}, separators=(",", ":")) + "\n")
+
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+        with self.lock:
+            appended: list[tuple[int, dict[str, str]]] = list(self.unacked)[len(pending):]
+            if len(appended) > 0:
+                with open(tmp_path, "a", encoding="utf-8") as tmp:
+                    for seq, (_, entry) in enumerate(appended, start=len(pending) + 1):
+                        tmp.write(json.dumps({"seq": seq, "entry": entry}, separators=(",", ":")) + "\n")
+
+                # They were only flushed in the old file too, the sync thread catches up on the new one
+                self._unsynced(len(appended))
+
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.unacked = deque((seq, entry) for seq, (_, entry) in enumerate(pending + appended, start=1))
+            self.sequence = len(self.unacked)
+
+    def _unsynced(self, count: int) -> None:
+        """Counts records written since the last fsync. Must be called with the lock held.
+
+        Wakes the sync thread once sync_every of them are waiting.
+
+        Args:
+            count: How many records were just written.
+        """
+        if self.unsynced == 0:
+            self.first_unsynced = time.monotonic()
+
+        self.unsynced += count
+        if self.unsynced >= self.sync_every:
+            self.wake.set()
+
+    def _sync(self) -> None:
+        """Flushes the journal under the lock and fsyncs it outside, so appends never wait on the disk."""
+        with self.lock:
+            if self.file.closed:
+                return
+
+            self.file.flush()
+            # A duplicate descriptor stays valid if compaction swaps the file while it syncs
+            fd: int = os.dup(self.file.fileno())
+            self.unsynced = 0
+
+        try:
+            os.fsync(fd)
+
+        finally:
+            os.close(fd)
+
+    def _sync_loop(self) -> None:
+        """Syncs once sync_every appends are waiting, or once the oldest has waited sync_interval."""
+        while not self.closed.is_set():
+            self.wake.wait(self.sync_interval / 2)
+            self.wake.clear()
+            with self.lock:
+                due: bool = self.unsynced >= self.sync_every or \
+                    (self.unsynced > 0 and time.monotonic() - self.first_unsynced >= self.sync_interval)
+
+            if due:
+                self._sync()
+
+    def close(self) -> None:
+        """Syncs anything outstanding and closes the journal."""
+        self.closed.set()
+        self.wake.set()
+        self.syncer.join(timeout=2)
+        self._sync()
+        with self.lock:
+            self.file.close()
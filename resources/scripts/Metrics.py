@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import bisect
+import threading as th
+from contextlib import contextmanager
+from collections.abc import Iterator
+from resources.scripts.Settings import settings
+
+# Upper bounds in milliseconds of the latency histogram buckets, the last bucket holds everything slower
+BUCKETS: tuple[float, ...] = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "max")
+
+    def __init__(self):
+        """Initializes an empty latency histogram with the fixed BUCKETS."""
+        self.counts: list[int] = [0] * (len(BUCKETS) + 1)
+        self.total: float = 0.0
+        self.count: int = 0
+        self.max: float = 0.0
+
+    def observe(self, ms: float) -> None:
+        """Records one latency.
+
+        Args:
+            ms: The latency in milliseconds.
+        """
+        self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.total += ms
+        self.count += 1
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q: The quantile, between 0 and 1.
+
+        Returns:
+            The estimate in milliseconds, or 0 if nothing was recorded.
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank: float = q * self.count
+        seen: int = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+
+        return self.max
+
+    def to_dict(self) -> dict:
+        """Returns the histogram in the form written to the metrics file."""
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "max_ms": round(self.max, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "buckets": {str(bound): count for bound, count in zip(BUCKETS + ("inf",), self.counts)},
+        }
+
+
+class Metrics:
+    def __init__(self):
+        """Initializes an empty set of counters, gauges and latency histograms shared by every stage."""
+        self.lock: th.Lock = th.Lock()
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.started: float = time.time()
+        self.thread: th.Thread | None = None
+        self.stopping: th.Event = th.Event()
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Adds to a counter.
+
+        Args:
+            name: The counter, e.g. "decode.found".
+            n: The amount to add.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name: str, value: float) -> None:
+        """Sets a gauge to its current value.
+
+        Args:
+            name: The gauge, e.g. "queue.depth".
+            value: The current value.
+        """
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Records the latency of one run of a stage.
+
+        Args:
+            name: The stage, e.g. "render".
+            seconds: How long it took.
+        """
+        with self.lock:
+            histogram: Histogram | None = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+
+            histogram.observe(seconds * 1000)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Records how long the body of a with block takes, including when it raises.
+
+        Args:
+            name: The stage.
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        """Returns every metric in the form written to the metrics file."""
+        with self.lock:
+            return {
+                "time": round(time.time(), 3),
+                "uptime": round(time.time() - self.started, 3),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "latency": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            }
+
+    def summary(self) -> list[str]:
+        """Returns one short line per stage for the on-screen stats overlay."""
+        with self.lock:
+            lines: list[str] = [
+                f"{name:<14} p50 {h.quantile(0.5):>5g} p95 {h.quantile(0.95):>5g} ms n={h.count}"
+                for name, h in sorted(self.histograms.items())
+            ]
+            lines.extend(f"{name:<14} {value:g}" for name, value in sorted(self.gauges.items()))
+            lines.extend(f"{name:<14} {value}" for name, value in sorted(self.counters.items()))
+
+        return lines
+
+    def dump(self, path: str) -> None:
+        """Appends a snapshot of every metric to a JSON lines file.
+
+        Args:
+            path: The metrics file.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(self.snapshot(), separators=(",", ":")) + "\n")
+
+    def start(self, path: str) -> None:
+        """Starts dumping to a file every "metrics seconds" from settings.
+
+        Args:
+            path: The metrics file.
+        """
+        if self.thread is None:
+            self.thread = th.Thread(target=self._dump_loop, args=(path,), name="metrics", daemon=True)
+            self.thread.start()
+
+    def _dump_loop(self, path: str) -> None:
+        """Dumps the metrics periodically until stopped, then one last time."""
+        while not self.stopping.wait(settings.get().metrics_interval):
+            self.dump(path)
+
+        self.dump(path)
+
+    def stop(self) -> None:
+        """Stops the dump thread after a final dump."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+metrics = Metrics()
@@ -1,133 +1,407 @@
+import os
 import cv2
+import time
 import numpy as np
-import qrcode as qr
-from gspread import Cell
 from hashlib import sha256
-from pwinput import pwinput
-from PIL import ImageFont, Image, ImageDraw
-from resources.scripts.AWS import handle_sync
+from resources.scripts.Camera import Camera
+from resources.scripts.Decoder import DecodePipeline
+from resources.scripts.Registry import DeviceRegistry
+from resources.scripts.Settings import settings, AppSettings
+from resources.scripts.Validation import ValidationStore, validation
 from resources.scripts.Logging import write_log
-from resources.scripts.FileIO import read, write
+from resources.scripts.Metrics import metrics
 from resources.scripts.TermColor import TermColor
-from resources.scripts.ImageTools import add_text
+from resources.scripts.ImageTools import PreviewRenderer
 from resources.scripts.Exceptions import BadOrderException, UnknownQRCodeException, StopExecution
 
 tc = TermColor()
 
+# Font used by each process rendering QR code labels, loaded on first use
+_font: "ImageFont.FreeTypeFont | None" = None
+
+
+def _hash_name(job: tuple[str, str]) -> str:
+    """Hashes a student's name the same way create_qr_codes does.
+
+    Args:
+        job: The name and the fuzzer used to join its parts.
+
+    Returns:
+        The hex digest stored in validation.json.
+    """
+    name, fuzz = job
+    return sha256(fuzz.join(name.split()).encode()).hexdigest()
+
+
+def _render_code(job: tuple[str, str, str]) -> str:
+    """Renders one labelled QR code image to disk. Runs in a worker process.
+
+    Args:
+        job: The data to encode, the label to print under it and the output folder.
+
+    Returns:
+        The label, so progress can be reported.
+    """
+    import qrcode as qr
+    from PIL import ImageFont, Image, ImageDraw
+
+    global _font
+    if _font is None:
+        _font = ImageFont.truetype("resources/data/RobotoMono-Regular.ttf", size=16)
+
+    data, label, path_out = job
+    result: Image = qr.make(data).get_image()
+    width, height = result.size
+    ImageDraw.Draw(result).text((width / 2 - _font.getlength(label) / 2, height - 30), label, font=_font)
+    result.save(f"{path_out}/{label}.png")
+    return label
+
 
 class QRProcessor:
-    def __init__(self, hash_dict: dict[str, str]):
+    def __init__(self, hash_dict: ValidationStore, camera: Camera, window: str = "Scanner",
+                 pipeline: DecodePipeline | None = None, headless: bool = False):
         """Initializes the QR processor with dictionaries for lookups and camera resources.
 
         Args:
-            hash_dict: A dictionary containing hashed QR code data for students.
+            hash_dict: The store of hashed QR code data for students.
+            camera: A started camera that stays open for the life of the process.
+            window: The title of the preview window.
+            pipeline: The decode pipeline, e.g. one warmed up while the rest of startup ran. Defaults to a new one.
+            headless: Whether to scan without a preview window or key presses, e.g. to measure throughput.
         """
-        self.hash_dict: dict[str, str] = hash_dict
-        self.decoder: cv2.QRCodeDetector = cv2.QRCodeDetector()
-        self.loading: np.ndarray = cv2.imread("resources/img/loading.png")
-        self.scan_img: np.ndarray = cv2.imread("resources/img/scan_img.png")
+        self.hash_dict: ValidationStore = hash_dict
+        self.camera: Camera = camera
+        self.window: str = window
+        self.headless: bool = headless
+        self.pipeline: DecodePipeline = pipeline or DecodePipeline()
+        self.renderer: PreviewRenderer = PreviewRenderer()
+        self.window_size: tuple[int, int] | None = None
+
+        # Stage metrics drawn over the preview, toggled with 't' and refreshed twice a second
+        self.show_stats: bool = False
+        self.stats: tuple[str, ...] = ()
+        self.stats_at: float = 0.0
+
+        # Feedback shown over the live preview, and the codes that are ignored while they are still in view
+        self.notice: tuple[str, bool] | None = None
+        self.notice_until: float = 0.0
+        self.held: tuple[str, ...] = ()
+        self.held_until: float = 0.0
+
+    def notify(self, text: str, seconds: float, error: bool = False, hold: str | tuple[str, ...] = "") -> None:
+        """Shows a message over the live preview for a while. Scanning carries on underneath it.
 
-    def read_code(self, message: str, device_names: list[str]) -> str:
+        Args:
+            text: The message to show.
+            seconds: How long to show it for.
+            error: Whether the message reports a problem.
+            hold: A code to ignore, usually the one that caused the message, or several codes. They are
+                ignored while the message shows and after that until they have been out of view for a second.
+        """
+        now: float = time.monotonic()
+        self.notice = (text, error)
+        self.notice_until = now + seconds
+        if len(hold) > 0:
+            self.held = (hold,) if isinstance(hold, str) else hold
+            self.held_until = now + seconds
+
+    def read_code(self, message: str, device_names: DeviceRegistry) -> str:
         """Reads a QR code from the camera.
 
         Args:
             message: A message to display on the camera preview.
-            device_names: A list of strings that contain valid devices.
+            device_names: The registry of valid devices.
 
         Returns:
             The decoded QR code data if successful, otherwise raises exceptions.
         """
-        cam: cv2.VideoCapture = cv2.VideoCapture(0)
+        self.pipeline.reset()
+        started: float = time.perf_counter()
+        last_id: int = -1
         while True:
-            raw_frame: np.ndarray
-            _, raw_frame = cam.read()
-
-            if raw_frame is None:
-                cv2.destroyAllWindows()
-                cam.release()
-                tc.print_fail("Could not read camera")
-                write_log()
-                raise StopExecution
+            frame_id, raw_frame, finished = self._next_frame(last_id)
 
             raw_result: str
-            raw_result, _, _ = self.decoder.detectAndDecode(raw_frame)
-            if raw_result != "":
-                if raw_result not in device_names and raw_result not in self.hash_dict.keys():
-                    badin: np.ndarray = add_text(self.loading.copy(), "Unrecognized QR Code", [10, 30])
-                    cv2.imshow("Scanner", badin)
-                    cv2.waitKey(3000)
-                    raise UnknownQRCodeException
+            for raw_result in self.pipeline.poll():
+                if self._is_held(raw_result):
+                    continue
 
+                self._check_known(raw_result, device_names)
+                metrics.observe("read_code", time.perf_counter() - started)
                 tc.print_ok(f"Read value: {raw_result}")
-                cam.release()
                 return raw_result
 
-            settings: dict[str, str | int] = read("resources/data/settings.json")
-            frame: np.ndarray = cv2.flip(raw_frame, 1)
-            frame = cv2.rectangle(frame, (0, 0), (225, 75), (255, 255, 255), -1)
-            frame = add_text(frame, message, [10, 30])
-            frame = add_text(frame, "Press 'q' to quit", [10, 60])
-            frame = cv2.resize(frame, (settings["window x"], settings["window y"]), interpolation=cv2.INTER_AREA)
-            cv2.namedWindow("Scanner", flags=cv2.WINDOW_GUI_NORMAL)
-            cv2.resizeWindow("Scanner", settings["window x"], settings["window y"])
-            cv2.imshow("Scanner", frame)
-
-            # Handle key presses
-            key: int = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                cv2.destroyAllWindows()
-                cam.release()
-                tc.print_ok("Exiting")
-                raise StopExecution
-
-            elif key == ord('s'):
-                cv2.destroyAllWindows()
-                handle_sync()
-
-            elif key == ord('n'):
-                cv2.destroyAllWindows()
-                self.create_qr_codes(
-                    "resources/qr_codes/output",
-                    fuzz=pwinput(f"Fuzzer for convolution (Ex. John{tc.format('fuzz', 'fail')}Doe): ")
+            if finished:
+                self._reached_end()
+
+            last_id = self._show(frame_id, raw_frame, last_id, message)
+
+    def read_pair(self, message: str, device_names: DeviceRegistry, wait: float = 0.6) -> tuple[str, str | None]:
+        """Reads a device and a student ID shown together, so a checkout takes one step instead of two.
+
+        Meant for a pipeline that looks for every code in a frame. Dense ID codes are often only found
+        in some frames, so a device and an ID seen within the given time of each other are paired too.
+        When only one code is in view for that long it is returned on its own, so the caller can carry
+        on with process_code and read_code like in the two-step flow.
+
+        Args:
+            message: A message to display on the camera preview.
+            device_names: The registry of valid devices.
+            wait: Seconds within which two codes seen in different frames still count as shown together.
+
+        Returns:
+            The device and the student's name, or the lone code's data and None.
+        """
+        self.pipeline.reset()
+        started: float = time.perf_counter()
+        last_id: int = -1
+        first_seen: dict[str, float] = {}
+        last_seen: dict[str, float] = {}
+        warned: set[str] = set()
+        while True:
+            frame_id, raw_frame, finished = self._next_frame(last_id)
+
+            group: tuple[str, ...]
+            for group in self.pipeline.poll_groups():
+                # The pair that was just handled is probably still in front of the camera. A student
+                # keeping their ID up while showing another device is a new pair
+                if all([self._is_held(data) for data in group]):
+                    continue
+
+                devices, students = self._classify(group, device_names)
+                if len(devices) == 1 and len(students) == 1:
+                    return self._accept_pair(devices[0], students, started)
+
+                metrics.count("scan.bad_pair")
+                self.notify("Show one device and one ID", 1.5, error=True)
+
+            raw_result: str
+            for raw_result in self.pipeline.poll():
+                if not self._is_held(raw_result):
+                    self._check_known(raw_result, device_names)
+                    first_seen.setdefault(raw_result, time.monotonic())
+                    last_seen[raw_result] = time.monotonic()
+
+            # A code that left the view starts over if it is shown again
+            now: float = time.monotonic()
+            for data in [data for data, seen in last_seen.items() if now - seen >= wait]:
+                del last_seen[data]
+                del first_seen[data]
+
+            recent: tuple[str, ...] = tuple(last_seen)
+            if len(recent) >= 2:
+                devices, students = self._classify(recent, device_names)
+                if len(devices) == 1 and len(students) == 1:
+                    return self._accept_pair(devices[0], students, started)
+
+                # Two devices, two IDs or more than two codes, say so once per set of codes
+                if set(recent) != warned:
+                    warned = set(recent)
+                    metrics.count("scan.bad_pair")
+                    self.notify("Show one device and one ID", 1.5, error=True)
+
+            elif len(recent) == 1 and now - first_seen[recent[0]] >= wait:
+                metrics.count("scan.single")
+                tc.print_ok(f"Read value: {recent[0]}")
+                return recent[0], None
+
+            if finished:
+                self._reached_end()
+
+            last_id = self._show(frame_id, raw_frame, last_id, message)
+
+    def _classify(self, group: tuple[str, ...], device_names: DeviceRegistry) -> tuple[list[str], dict[str, str]]:
+        """Splits codes seen together into devices and students.
+
+        Args:
+            group: The codes.
+            device_names: The registry of valid devices.
+
+        Returns:
+            The device codes, and each student code mapped to the student's name. Raises
+            UnknownQRCodeException if a code is neither.
+        """
+        with metrics.timer("process_code"):
+            names: dict[str, str | None] = {data: self.hash_dict.get(data) for data in group}
+
+        for data, name in names.items():
+            if name is None:
+                self._check_known(data, device_names)
+
+        return [data for data, name in names.items() if name is None], \
+            {data: name for data, name in names.items() if name is not None}
+
+    def _accept_pair(self, device: str, students: dict[str, str], started: float) -> tuple[str, str]:
+        """Reports a device and student read together and holds both codes while they stay in view.
+
+        Returns:
+            The device and the student's name.
+        """
+        data, student = next(iter(students.items()))
+        metrics.count("scan.pair")
+        metrics.observe("read_pair", time.perf_counter() - started)
+        tc.print_ok(f"Read values: {device} and {student}")
+        self.notify(f"Obtained: {device} and {student}", 0.5, hold=(device, data))
+        return device, student
+
+    def _is_held(self, data: str) -> bool:
+        """Checks whether a code was just handled and is still in view, keeping it held if so."""
+        if data in self.held and time.monotonic() < self.held_until:
+            self.held_until = max(self.held_until, time.monotonic() + 1.0)
+            return True
+
+        return False
+
+    def _check_known(self, data: str, device_names: DeviceRegistry) -> None:
+        """Raises UnknownQRCodeException, after telling the user, if a code is neither a device nor a student."""
+        if data not in device_names and data not in self.hash_dict:
+            metrics.count("scan.unknown")
+            self.notify("Unrecognized QR Code", 3.0, error=True, hold=data)
+            raise UnknownQRCodeException
+
+    def _next_frame(self, last_id: int) -> tuple[int, np.ndarray | None, bool]:
+        """Takes the freshest frame from the camera, stopping if the camera failed.
+
+        Args:
+            last_id: The frame handled last.
+
+        Returns:
+            The frame's sequence number, the frame, and whether a recording ran out and its last frames
+            have been decoded, in which case the scanner stops once their results have been read.
+        """
+        frame_id: int
+        raw_frame: np.ndarray | None
+        frame_id, raw_frame = self.camera.latest()
+
+        finished: bool = self.camera.ended and frame_id == last_id and self.pipeline.idle()
+        if self.camera.is_failed() and not self.camera.ended:
+            cv2.destroyAllWindows()
+            tc.print_fail("Could not read camera")
+            write_log()
+            raise StopExecution
+
+        return frame_id, raw_frame, finished
+
+    def _reached_end(self) -> None:
+        """Stops scanning at the end of a recording."""
+        cv2.destroyAllWindows()
+        tc.print_ok(f"Reached the end of {self.camera.source.name}")
+        raise StopExecution
+
+    def _show(self, frame_id: int, raw_frame: np.ndarray | None, last_id: int, message: str) -> int:
+        """Hands a new frame to the decoders and the preview, and handles key presses.
+
+        Args:
+            frame_id: The frame's sequence number.
+            raw_frame: The frame.
+            last_id: The frame handled last.
+            message: A message to display on the camera preview.
+
+        Returns:
+            The sequence number of the frame handled last, after this one.
+        """
+        if self.headless:
+            if frame_id != last_id and raw_frame is not None:
+                self.pipeline.submit(raw_frame)
+                return frame_id
+
+            time.sleep(0.001)
+            return last_id
+
+        # Only hand new frames to the decoders and the preview, the capture thread may not have a fresh one yet
+        if raw_frame is not None and frame_id != last_id:
+            last_id = frame_id
+            self.pipeline.submit(raw_frame)
+
+            config: AppSettings = settings.get()
+            size: tuple[int, int] = (config.window_x, config.window_y)
+            notice: tuple[str, bool] | None = self.notice if time.monotonic() < self.notice_until else None
+            if self.show_stats and time.monotonic() - self.stats_at > 0.5:
+                self.stats = tuple(metrics.summary())
+                self.stats_at = time.monotonic()
+
+            with metrics.timer("render"):
+                frame: np.ndarray = self.renderer.render(
+                    raw_frame, message, size, notice, self.stats if self.show_stats else None
                 )
 
-    def process_code(self, data: str, accepted_devices: list[str], expecting: str) -> str:
+            # Only set the window up when it is first shown or its size changes in settings
+            if self.window_size != size:
+                cv2.namedWindow(self.window, flags=cv2.WINDOW_GUI_NORMAL)
+                cv2.resizeWindow(self.window, *size)
+                self.window_size = size
+
+            cv2.imshow(self.window, frame)
+
+        # Handle key presses
+        key: int = cv2.waitKey(1) & 0xFF
+        if key == ord('q'):
+            cv2.destroyAllWindows()
+            tc.print_ok("Exiting")
+            raise StopExecution
+
+        elif key == ord('t'):
+            self.show_stats = not self.show_stats
+            self.stats_at = 0.0
+
+        # The sync and QR code tools pull in requests, qrcode and PIL, so they are only imported when used
+        elif key == ord('s'):
+            from resources.scripts.AWS import handle_sync
+
+            cv2.destroyAllWindows()
+            self.window_size = None
+            handle_sync()
+
+        elif key == ord('n'):
+            from pwinput import pwinput
+
+            cv2.destroyAllWindows()
+            self.window_size = None
+            self.create_qr_codes(
+                "resources/qr_codes/output",
+                fuzz=pwinput(f"Fuzzer for convolution (Ex. John{tc.format('fuzz', 'fail')}Doe): ")
+            )
+
+        return last_id
+
+    def close(self) -> None:
+        """Stops the decode workers. The camera is owned by the caller and released separately."""
+        self.pipeline.close()
+
+    def process_code(self, data: str, accepted_devices: DeviceRegistry, expecting: str) -> str:
         """Processes the decoded QR code data based on expectations.
 
         Args:
             data: The decoded QR code data.
-            accepted_devices: A list containing accepted device names.
+            accepted_devices: The registry of accepted devices.
             expecting: The expected type of data ("student" or "device").
 
         Returns:
             The processed value (student ID or device status), or raises exceptions.
         """
-        if data in self.hash_dict:
-            obtained: np.ndarray = add_text(self.scan_img.copy(), f"Obtained: {(self.hash_dict[data])}", [10, 30])
-            cv2.imshow("Scanner", obtained)
-            cv2.waitKey(500)
+        with metrics.timer("process_code"):
+            student: str | None = self.hash_dict.get(data)
 
+        if student is not None:
             if expecting == "student":
-                return self.hash_dict[data]
+                metrics.count("scan.accepted")
+                self.notify(f"Obtained: {student}", 0.5, hold=data)
+                return student
 
             else:
-                expected: np.ndarray = add_text(self.loading.copy(), "Expected a device", [10, 30])
-                cv2.imshow("Scanner", expected)
-                cv2.waitKey(3000)
+                metrics.count("scan.bad_order")
+                self.notify("Expected a device", 3.0, error=True, hold=data)
                 raise BadOrderException
 
         elif data in accepted_devices:
-            obtained: np.ndarray = add_text(self.scan_img.copy(), f"Obtained: {data}", [10, 30])
-            cv2.imshow("Scanner", obtained)
-            cv2.waitKey(500)
-
             if expecting == "rental":
+                metrics.count("scan.accepted")
+                self.notify(f"Obtained: {data}", 0.5, hold=data)
                 return data
 
             else:
-                expected: np.ndarray = add_text(self.loading.copy(), "Expected an ID", [10, 30])
-                cv2.imshow("Scanner", expected)
-                cv2.waitKey(3000)
+                metrics.count("scan.bad_order")
+                self.notify("Expected an ID", 3.0, error=True, hold=data)
                 raise BadOrderException
 
     @staticmethod
@@ -138,6 +412,9 @@ class QRProcessor:
             path_out: The output path to save the QR code images.
             fuzz: An optional string to add a fuzzing factor for encryption.
         """
+        import qrcode as qr
+        from PIL import ImageFont, Image, ImageDraw
+
         names: dict[str, str] = {}
         tc.print_help("Enter nothing when finished.")
 
@@ -155,14 +432,13 @@ class QRProcessor:
 
         if input("Continue? (y/n) ").lower() == 'y':
             font: ImageFont = ImageFont.truetype("resources/data/RobotoMono-Regular.ttf", size=16)
-            validation_json: dict[str, str] = read("resources/data/validation.json", exit_on_error=True)
             for entry, processing in names.items():
                 stripped: str = entry.strip()
 
                 if processing == "encrypt":
                     try:
                         data: str = sha256(fuzz.join(stripped.split()).encode()).hexdigest()
-                        if data in validation_json:
+                        if data in validation:
                             raise ValueError
 
                         result: Image = qr.make(data).get_image()
@@ -177,8 +453,7 @@ class QRProcessor:
                         write_log()
                         raise StopExecution
 
-                    validation_json[data] = stripped
-                    write("resources/data/validation.json", validation_json)
+                    validation.add(data, stripped)
 
                 else:
                     result: Image = qr.make(stripped).get_image()
@@ -191,3 +466,77 @@ class QRProcessor:
                     font=font
                 )
                 result.save(f"{path_out}/{stripped}.png")
+
+    @staticmethod
+    def create_qr_codes_from_roster(roster_path: str, path_out: str, fuzz: str, workers: int | None = None) -> None:
+        """Creates QR codes for a whole roster at once.
+
+        The roster is a CSV file with a "name" column (or the name in the first column when
+        there is no header) and an optional "kind" column set to "student" or "device". Without
+        a kind, single word names are treated as devices like in create_qr_codes. Names are
+        hashed and images rendered across a process pool, duplicates are skipped and reported,
+        and the new students are added to the validation store in one transaction.
+
+        Args:
+            roster_path: The CSV file to read.
+            path_out: The output path to save the QR code images.
+            fuzz: The fuzzing factor used when hashing student names.
+            workers: Number of worker processes. Defaults to the number of cores.
+        """
+        import csv
+        from tqdm import tqdm
+        from concurrent.futures import ProcessPoolExecutor
+
+        with open(roster_path, "r", newline="") as f:
+            rows: list[list[str]] = [row for row in csv.reader(f) if len(row) > 0 and row[0].strip() != ""]
+
+        header: list[str] = [column.strip().lower() for column in rows[0]] if len(rows) > 0 else []
+        name_col: int = header.index("name") if "name" in header else 0
+        kind_col: int | None = header.index("kind") if "kind" in header else None
+        if "name" in header:
+            rows = rows[1:]
+
+        students: dict[str, None] = {}
+        devices: dict[str, None] = {}
+        for row in rows:
+            name: str = " ".join(row[name_col].split())
+            kind: str = row[kind_col].strip().lower() if kind_col is not None and kind_col < len(row) else ""
+            if kind == "device" or (kind == "" and len(name.split()) < 2):
+                devices[name] = None
+
+            else:
+                students[name] = None
+
+        tc.print_ok(f"Read {len(students)} students and {len(devices)} devices from {roster_path}")
+        jobs: list[tuple[str, str, str]] = [(name, name, path_out) for name in devices]
+        workers = workers or os.cpu_count() or 1
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            names: list[str] = list(students)
+            hashes: list[str] = list(tqdm(
+                pool.map(_hash_name, [(name, fuzz) for name in names], chunksize=max(1, len(names) // (workers * 4))),
+                total=len(names), desc="Hashing names", unit=" names", dynamic_ncols=True
+            ))
+
+            # Check every hash against the existing validation index before anything is rendered
+            duplicates: list[str] = []
+            added: dict[str, str] = {}
+            for name, data in zip(names, hashes):
+                if data in validation or data in added:
+                    duplicates.append(name)
+
+                else:
+                    added[data] = name
+                    jobs.append((data, name, path_out))
+
+            if len(duplicates) > 0:
+                tc.print_warning(f"Skipping {len(duplicates)} names already in validation: {', '.join(duplicates)}")
+
+            for _ in tqdm(
+                    pool.map(_render_code, jobs, chunksize=max(1, len(jobs) // (workers * 4))),
+                    total=len(jobs), desc="Rendering QR codes", unit=" codes", dynamic_ncols=True
+            ):
+                pass
+
+        validation.add_many(added.items())
+        tc.print_ok(f"Created {len(jobs)} QR codes in {path_out} and added {len(added)} students to validation")
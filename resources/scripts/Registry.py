@@ -0,0 +1,116 @@
+from gspread import Cell
+from collections.abc import Iterator
+from resources.scripts.Settings import settings
+
+
+def route(device: str) -> str:
+    """Finds the category a device belongs to from the prefixes in settings.
+
+    Used for devices the registry has not seen, such as entries replayed from an old journal.
+
+    Args:
+        device: The device name.
+
+    Returns:
+        The category whose longest prefix matches, or the default category.
+    """
+    config = settings.get()
+    best: tuple[int, str] = (0, config.default_category)
+    for category, prefixes in config.prefixes.items():
+        for prefix in prefixes:
+            if device.startswith(prefix) and len(prefix) > best[0]:
+                best = (len(prefix), category)
+
+    return best[1]
+
+
+class DeviceRecord:
+    __slots__ = ("category", "status")
+
+    def __init__(self, category: str, status: Cell):
+        """Initializes what the scanner needs to know about one device.
+
+        Args:
+            category: The category the device belongs to.
+            status: The device's status cell (column H) on its worksheet.
+        """
+        self.category: str = category
+        self.status: Cell = status
+
+
+class DeviceRegistry:
+    def __init__(self):
+        """Initializes an empty registry mapping device names to their category and status."""
+        self.records: dict[str, DeviceRecord] = {}
+
+    def __contains__(self, device: object) -> bool:
+        return device in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.records)
+
+    def get(self, device: str) -> DeviceRecord | None:
+        """Looks up a device.
+
+        Args:
+            device: The device name.
+
+        Returns:
+            The device's record, or None if it is not tracked.
+        """
+        return self.records.get(device)
+
+    def load(self, category: str, statuses: dict[str, Cell]) -> None:
+        """Adds or refreshes every device of a category.
+
+        Existing records keep their identity and only have their status value replaced.
+
+        Args:
+            category: The category the devices belong to.
+            statuses: Device name mapped to its status cell.
+        """
+        for device, cell in statuses.items():
+            record: DeviceRecord | None = self.records.get(device)
+            if record is None:
+                self.records[device] = DeviceRecord(category, cell)
+
+            else:
+                record.category = category
+                record.status.value = cell.value
+
+    def set_status(self, device: str, status: str) -> None:
+        """Sets a device's local status if the device is tracked.
+
+        Args:
+            device: The device name.
+            status: Either "IN" or "OUT".
+        """
+        record: DeviceRecord | None = self.records.get(device)
+        if record is not None:
+            record.status.value = status
+
+    def toggle(self, device: str) -> str:
+        """Flips a device between IN and OUT.
+
+        Args:
+            device: The device name. Must be tracked.
+
+        Returns:
+            The device's new status.
+        """
+        record: DeviceRecord = self.records[device]
+        # A blank status means the device has never been rented out
+        record.status.value = {"IN": "OUT", "OUT": "IN"}.get(record.status.value, "OUT")
+        return record.status.value
+
+    def category_of(self, device: str) -> str:
+        """Returns the category of a device, routing by prefix if it is not tracked.
+
+        Args:
+            device: The device name.
+        """
+        record: DeviceRecord | None = self.records.get(device)
+        return record.category if record is not None else route(device)
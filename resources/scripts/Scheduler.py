@@ -0,0 +1,165 @@
+import time
+import random
+import requests
+import threading as th
+from typing import Any, Callable
+from gspread.exceptions import APIError
+from resources.scripts.Metrics import metrics
+from resources.scripts.TermColor import TermColor
+
+tc = TermColor()
+
+# Google answers with these when a request should be retried later
+RETRYABLE_CODES: set[int] = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, period: float = 60.0):
+        """Initializes a bucket that refills capacity tokens every period seconds.
+
+        Args:
+            capacity: The number of requests allowed per period.
+            period: The quota window in seconds.
+        """
+        self.capacity: float = float(capacity)
+        self.rate: float = capacity / period
+        self.tokens: float = float(capacity)
+        self.updated: float = time.monotonic()
+        self.lock: th.Lock = th.Lock()
+
+    def _refill(self) -> None:
+        """Adds the tokens earned since the last refill. Must be called with the lock held."""
+        now: float = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Takes a token if one is available.
+
+        Returns:
+            0 if a token was taken, otherwise the number of seconds until one will be.
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+
+            return (1 - self.tokens) / self.rate
+
+    def drain(self) -> None:
+        """Empties the bucket, used when the server says the quota is exhausted regardless of local accounting."""
+        with self.lock:
+            self._refill()
+            self.tokens = 0.0
+
+    def available(self) -> float:
+        """Returns the number of tokens that could be taken right now."""
+        with self.lock:
+            self._refill()
+            return self.tokens
+
+
+class RequestScheduler:
+    def __init__(self, reads_per_minute: int = 60, writes_per_minute: int = 60,
+                 base_delay: float = 1.0, max_delay: float = 64.0, max_attempts: int = 8):
+        """Initializes the scheduler that every Google Sheets request goes through.
+
+        Args:
+            reads_per_minute: Read quota per minute for this client.
+            writes_per_minute: Write quota per minute for this client.
+            base_delay: First backoff delay in seconds after a retryable failure.
+            max_delay: Largest backoff delay in seconds.
+            max_attempts: How many times a request is tried before its error is raised to the caller.
+        """
+        self.buckets: dict[str, TokenBucket] = {
+            "read": TokenBucket(reads_per_minute),
+            "write": TokenBucket(writes_per_minute),
+        }
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.max_attempts: int = max_attempts
+        self.lock: th.Lock = th.Lock()
+        self.calls: dict[str, int] = {"read": 0, "write": 0}
+        self.retries: int = 0
+
+    def call(self, kind: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs a gspread call once quota allows, retrying 429 and 5xx responses with jittered backoff.
+
+        This blocks the calling thread, so it must only be used from background threads or during startup.
+        Callers keep whatever they could not send and try again later, nothing is dropped here.
+
+        Args:
+            kind: Either "read" or "write", the quota the call counts against.
+            fn: The gspread method to call.
+            *args: Positional arguments for fn.
+            **kwargs: Keyword arguments for fn.
+
+        Returns:
+            Whatever fn returns.
+        """
+        bucket: TokenBucket = self.buckets[kind]
+        attempt: int = 0
+        while True:
+            self._acquire(kind)
+            try:
+                return fn(*args, **kwargs)
+
+            except APIError as e:
+                if e.code not in RETRYABLE_CODES or attempt + 1 >= self.max_attempts:
+                    raise
+
+                if e.code == 429:
+                    bucket.drain()
+
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt + 1 >= self.max_attempts:
+                    raise
+
+            # Full jitter keeps several retrying threads from hitting the API in lockstep
+            attempt += 1
+            delay: float = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            with self.lock:
+                self.retries += 1
+
+            metrics.count("api.retries")
+            tc.print_warning(f"Sheets {kind} request failed. Retrying in {delay:.1f}s (attempt {attempt + 1})")
+            time.sleep(delay)
+
+    def once(self, kind: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs a gspread call once quota allows, without retrying. Used to check whether the API can be reached.
+
+        Args:
+            kind: Either "read" or "write", the quota the call counts against.
+            fn: The gspread method to call.
+            *args: Positional arguments for fn.
+            **kwargs: Keyword arguments for fn.
+
+        Returns:
+            Whatever fn returns.
+        """
+        self._acquire(kind)
+        return fn(*args, **kwargs)
+
+    def _acquire(self, kind: str) -> None:
+        """Waits for a token from a quota and counts the request against it."""
+        while (wait := self.buckets[kind].take()) > 0:
+            time.sleep(wait)
+
+        with self.lock:
+            self.calls[kind] += 1
+
+        metrics.count(f"api.{kind}")
+
+    def headroom(self) -> dict[str, float]:
+        """Returns the fraction of each quota that is still available, from 0 (exhausted) to 1 (untouched)."""
+        return {kind: bucket.available() / bucket.capacity for kind, bucket in self.buckets.items()}
+
+    def describe(self) -> str:
+        """Returns a one line summary of quota headroom and request counts."""
+        headroom: dict[str, float] = self.headroom()
+        return (f"Quota headroom: reads {headroom['read']:.0%}, writes {headroom['write']:.0%} "
+                f"({self.calls['read']} reads, {self.calls['write']} writes, {self.retries} retries)")
+
+
+scheduler: RequestScheduler = RequestScheduler()
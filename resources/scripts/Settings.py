@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import threading as th
+from dataclasses import dataclass, field
+from resources.scripts.FileIO import read
+from resources.scripts.TermColor import TermColor
+
+tc = TermColor()
+
+
+@dataclass(frozen=True)
+class AppSettings:
+    """Typed view of settings.json.
+
+    Attributes:
+        window_x: Width of the scanner window in pixels.
+        window_y: Height of the scanner window in pixels.
+        spreadsheet: Name of the Google Sheets document to open.
+        sheets: Category name mapped to the worksheet holding it.
+        prefixes: Category name mapped to the device name prefixes that belong to it.
+        default_category: Category for devices that match no prefix.
+        resync_interval: Seconds before the local copy of a worksheet is re-read even without signs of drift.
+        flush_size: Number of queued scans that triggers a flush to the sheet.
+        flush_interval: Longest time in seconds between flushes to the sheet.
+        metrics_interval: Seconds between dumps of the stage metrics to logs/metrics.jsonl.
+        aws_pull_url: Endpoint the API key and validation data are downloaded from.
+        aws_push_url: Endpoint the API key and validation data are uploaded to.
+        raw: The untouched contents of settings.json.
+    """
+    window_x: int
+    window_y: int
+    spreadsheet: str
+    sheets: dict[str, str]
+    prefixes: dict[str, tuple[str, ...]]
+    default_category: str
+    resync_interval: float
+    flush_size: int
+    flush_interval: float
+    metrics_interval: float
+    aws_pull_url: str
+    aws_push_url: str
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "AppSettings":
+        """Builds the typed settings from the parsed JSON.
+
+        Args:
+            raw: The contents of settings.json.
+
+        Returns:
+            The typed settings object. Raises ValueError, KeyError or TypeError if a setting is missing
+            or has the wrong type.
+        """
+        categories: dict[str, dict] = raw.get("categories") or {
+            # Older settings files only name a worksheet per category with "<category> sheet"
+            key.removesuffix(" sheet"): {"sheet": value} for key, value in raw.items() if key.endswith(" sheet")
+        }
+        if not isinstance(categories, dict) or len(categories) == 0:
+            raise ValueError("settings.json names no categories")
+
+        if not all(isinstance(c, dict) and isinstance(c.get("sheet"), str) for c in categories.values()):
+            raise ValueError("Every category in settings.json needs a \"sheet\"")
+
+        default_category: str = next(
+            (name for name, category in categories.items() if category.get("default", False)), next(iter(categories))
+        )
+
+        return cls(
+            window_x=int(raw["window x"]),
+            window_y=int(raw["window y"]),
+            spreadsheet=raw.get("spreadsheet", "Chromebook Tracker"),
+            sheets={name: category["sheet"] for name, category in categories.items()},
+            prefixes={name: tuple(category.get("prefixes", [])) for name, category in categories.items()},
+            default_category=default_category,
+            resync_interval=float(raw.get("sheet resync seconds", 600)),
+            flush_size=int(raw.get("flush size", 20)),
+            flush_interval=float(raw.get("flush seconds", 100)),
+            metrics_interval=float(raw.get("metrics seconds", 60)),
+            aws_pull_url=raw.get("aws pull url", "https://tryobgwrhsrnbyq5re77znzxry0brhfc.lambda-url.ca-central-1.on.aws/"),
+            aws_push_url=raw.get("aws push url", "https://i5nqbfht5a6v4epzr5anistot40qkyaz.lambda-url.ca-central-1.on.aws/"),
+            raw=raw,
+        )
+
+
+class SettingsService:
+    def __init__(self, path: str, check_interval: float = 3.0):
+        """Initializes a cached settings loader that reloads when the file changes.
+
+        Args:
+            path: The path to settings.json.
+            check_interval: Minimum number of seconds between checks of the file's mtime.
+        """
+        self.path: str = path
+        self.check_interval: float = check_interval
+        self.lock: th.Lock = th.Lock()
+        self.current: AppSettings | None = None
+        self.mtime: float = 0.0
+        self.last_check: float = 0.0
+
+    def get(self) -> AppSettings:
+        """Returns the cached settings, reloading them first if the file has changed.
+
+        The file is only stat'ed once every check_interval seconds so this is cheap
+        enough to call once per camera frame.
+
+        Returns:
+            The current settings.
+        """
+        now: float = time.monotonic()
+        if self.current is not None and now - self.last_check < self.check_interval:
+            return self.current
+
+        with self.lock:
+            if self.current is None:
+                self.current = AppSettings.from_dict(read(self.path))
+                self.mtime = os.stat(self.path).st_mtime
+
+            elif now - self.last_check >= self.check_interval:
+                self._reload_if_changed()
+
+            self.last_check = now
+            return self.current
+
+    def _reload_if_changed(self) -> None:
+        """Reloads the settings if the file's mtime moved. Keeps the old settings if the new file is bad."""
+        try:
+            mtime: float = os.stat(self.path).st_mtime
+            if mtime == self.mtime:
+                return
+
+            with open(self.path, "r") as f:
+                self.current = AppSettings.from_dict(json.load(f))
+
+            self.mtime = mtime
+            tc.print_ok("Reloaded settings")
+
+        # A hand edit can break the file in many ways, none of them should stop the scanner
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            tc.print_warning(f"Could not reload {self.path} ({e!r}). Keeping previous settings")
+
+
+settings: SettingsService = SettingsService("resources/data/settings.json")
@@ -1,80 +1,415 @@
+import os
+import json
+import time
+import threading as th
+from datetime import datetime
+from resources.scripts.Settings import settings
+from resources.scripts.Registry import route
+from resources.scripts.Metrics import metrics
+from resources.scripts.Scheduler import scheduler
 from resources.scripts.TermColor import TermColor
-from gspread import Worksheet, Cell
+from resources.scripts.Storage import StorageBackend
+from gspread import Client, Spreadsheet, Worksheet, Cell
 
 tc = TermColor()
 
 
-def pull_statuses(sheet: Worksheet) -> dict[str, Cell]:
-    """Obtains the status columns from the given worksheet.
+class SheetState:
+    def __init__(self, category: str):
+        """Initializes the local copy of a category's statuses.
+
+        Args:
+            category: The category this state mirrors.
+        """
+        self.category: str = category
+        self.statuses: dict[str, Cell] = {}
+        self.synced_at: float = 0.0
+        self.stale: bool = True
+        self.unwritten: dict[str, str] = {}
+
+    def load(self, statuses: dict[str, Cell]) -> None:
+        """Replaces the local copy with freshly read values.
+
+        Args:
+            statuses: Device name mapped to its status cell.
+        """
+        self.statuses = statuses
+        self.synced_at = time.monotonic()
+        self.stale = False
+
+    def drifted(self, entries: list[dict[str, str]]) -> bool:
+        """Checks whether the local copy can no longer be trusted for these entries.
+
+        The copy is stale after a failed write, after the resync interval from settings has
+        passed, or when an entry names a device the copy has never seen.
+
+        Args:
+            entries: The entries about to be written.
+
+        Returns:
+            True if the storage should be re-read before writing.
+        """
+        if self.stale or time.monotonic() - self.synced_at > settings.get().resync_interval:
+            return True
+
+        return any(entry["device"] not in self.statuses for entry in entries)
+
+    def plan(self, entries: list[dict[str, str]]) -> list[dict]:
+        """Plans the new log rows and every status cell that still needs writing.
+
+        The storage finds where the log ends when it writes, so rows added by another station or by
+        hand since the last read are not overwritten. Status cells are only included when their
+        final value differs from the copy of the storage. Changes from earlier flushes that failed to
+        write are included again until they succeed.
+
+        Args:
+            entries: The entries to write, oldest first.
+
+        Returns:
+            The planned writes, in the form described by StorageBackend.
+        """
+        writes: list[dict] = []
+        if len(entries) > 0:
+            writes.append({"kind": "log", "category": self.category, "entries": entries})
+
+        for entry in entries:
+            device: str = entry["device"]
+            if device not in self.statuses:
+                tc.print_warning(f"{device} is not listed under {self.category}. Only logging it")
+
+            elif self.statuses[device].value != entry["action"]:
+                self.unwritten[device] = entry["action"]
+
+            else:
+                self.unwritten.pop(device, None)
+
+        # A device removed from the sheet since its change was planned can no longer be written
+        for device in [device for device in self.unwritten if device not in self.statuses]:
+            tc.print_warning(f"{device} is no longer listed under {self.category}. Dropping its status change")
+            del self.unwritten[device]
+
+        for device, action in self.unwritten.items():
+            writes.append({
+                "kind": "status",
+                "category": self.category,
+                "device": device,
+                "row": self.statuses[device].row,
+                "value": action,
+            })
+
+        return writes
+
+    def apply(self, planned: dict, ok: bool) -> None:
+        """Updates the local copy with the outcome of one planned write.
+
+        Args:
+            planned: A write returned by plan().
+            ok: Whether the storage confirmed the write.
+        """
+        # Rows may have been moved or deleted on the sheet, re-read it before the next flush
+        if not ok:
+            self.stale = True
+
+        elif planned["kind"] == "status":
+            device: str = planned["device"]
+            self.statuses[device].value = planned["value"]
+            if self.unwritten.get(device) == planned["value"]:
+                del self.unwritten[device]
+
+
+class BatchResult:
+    def __init__(self):
+        """Initializes the outcome of a batched flush.
+
+        Attributes:
+            succeeded: Labels of the writes the storage confirmed (A1 ranges for the spreadsheet).
+            failed: Labels of the writes that did not go through.
+            retry: Entries whose log rows were not written and should be queued again.
+        """
+        self.succeeded: list[str] = []
+        self.failed: list[str] = []
+        self.retry: list[dict[str, str]] = []
+
+
+# Local state for every category written to
+_states: dict[str, SheetState] = {}
+_states_lock: th.RLock = th.RLock()
+
+
+def sheet_state(category: str) -> SheetState:
+    """Returns the local state for a category, creating it on first use.
+
+    Args:
+        category: The category to look up.
+
+    Returns:
+        The category's state.
+    """
+    with _states_lock:
+        if category not in _states:
+            _states[category] = SheetState(category)
+
+        return _states[category]
+
+
+def open_sheets(client: Client, retry: bool = True) -> dict[str, Worksheet]:
+    """Opens the tracker spreadsheet and the worksheet for each category named in settings.
+
+    Args:
+        client: An authenticated gspread client.
+        retry: Whether to retry failed requests. Turned off to find out quickly whether the sheet can be reached.
+
+    Returns:
+        Category name mapped to its worksheet.
+    """
+    config = settings.get()
+    call = scheduler.call if retry else scheduler.once
+    main_sheet: Spreadsheet = call("read", client.open, config.spreadsheet)
+
+    # One metadata request for every worksheet instead of one per category
+    worksheets: dict[str, Worksheet] = {sheet.title: sheet for sheet in call("read", main_sheet.worksheets)}
+    return {category: worksheets[title] for category, title in config.sheets.items()}
+
+
+def load_all(backend: StorageBackend, categories: list[str] | None = None) -> dict[str, SheetState]:
+    """Reads the statuses of every category in a single batched request.
+
+    Args:
+        backend: The storage to read from.
+        categories: The categories to read. Defaults to every category the backend stores.
+
+    Returns:
+        Category name mapped to its refreshed state.
+    """
+    with _states_lock:
+        categories = categories or backend.categories()
+        states: dict[str, SheetState] = {}
+        for category, statuses in backend.read(categories).items():
+            states[category] = sheet_state(category)
+            states[category].load(statuses)
+
+        return states
+
+
+def reconcile(backend: StorageBackend, pending: list[dict[str, str]]) -> tuple[dict[str, SheetState], list[dict]]:
+    """Re-reads every category and finds devices changed on the sheet that also have scans waiting locally.
+
+    The last known copy of each category is the baseline. A device whose status on the sheet no
+    longer matches it was changed by someone else, while offline or since the last read. That is
+    only a conflict when the scanner also has unwritten changes for the device that disagree with
+    the sheet, and those still win on the next flush since they record what happened at the desk.
+
+    Args:
+        backend: The storage to read from.
+        pending: Scans that have not been pushed yet, oldest first.
+
+    Returns:
+        Category name mapped to its refreshed state, and one record per conflicting device.
+    """
+    with _states_lock:
+        categories: list[str] = backend.categories()
+        baseline: dict[str, dict[str, str]] = {
+            category: {name: cell.value for name, cell in sheet_state(category).statuses.items()}
+            for category in categories
+        }
+
+        local: dict[str, str] = {}
+        for category in categories:
+            local.update(sheet_state(category).unwritten)
+
+        for entry in pending:
+            local[entry["device"]] = entry["action"]
+
+        fresh: dict[str, SheetState] = load_all(backend, categories)
+
+    conflicts: list[dict] = []
+    for category, state in fresh.items():
+        for name, cell in state.statuses.items():
+            before: str | None = baseline[category].get(name)
+            if name in local and before is not None and before != cell.value != local[name]:
+                conflicts.append({
+                    "category": category,
+                    "device": name,
+                    "last_known": before,
+                    "sheet": cell.value,
+                    "local": local[name],
+                })
+
+    return fresh, conflicts
+
+
+def report_conflicts(conflicts: list[dict], directory: str = "logs") -> str | None:
+    """Prints conflicts found by reconcile and saves them to a timestamped file.
 
     Args:
-        sheet: gspread worksheet to pull from.
+        conflicts: The conflict records.
+        directory: Where to save the report.
+
+    Returns:
+        The report's path, or None if there were no conflicts.
     """
-    statuses: dict[str, Cell] = {}
-    last_row: int = len(sheet.col_values(7))
-    statuses.update(
-        zip(
-            # Device name (Column G) ------------maps to-----------> Device status (Column H)
-            [name.value for name in sheet.range(f"G2:G{last_row}")], sheet.range(f"H2:H{last_row}")
-        )
-    )
+    if len(conflicts) == 0:
+        return None
+
+    for conflict in conflicts:
+        tc.print_warning(f"{conflict['device']} was changed on the sheet from {conflict['last_known'] or 'blank'} "
+                         f"to {conflict['sheet'] or 'blank'} while scans here set it {conflict['local']}. "
+                         f"Keeping {conflict['local']}")
+
+    os.makedirs(directory, exist_ok=True)
+    path: str = f"{directory}/{time.strftime('%Y-%m-%d_%H%M%S')}_conflicts.json"
+    with open(path, "w") as f:
+        json.dump({"found": datetime.now().isoformat(timespec="seconds"), "conflicts": conflicts}, f, indent=4)
 
-    return statuses
+    tc.print_warning(f"{len(conflicts)} conflicts with the sheet saved to {path}")
+    return path
 
 
-def update(entries: list[dict[str, str]], sheets: dict[str, Worksheet]) -> None:
-    """Update a Google Sheets document.
+def status_copies(state: SheetState) -> dict[str, Cell]:
+    """Copies a worksheet's status cells so they can be changed locally without touching the sheet's state.
+
+    Args:
+        state: The worksheet state to copy.
+
+    Returns:
+        Device name mapped to a copy of its status cell.
+    """
+    return {name: Cell(cell.row, cell.col, cell.value) for name, cell in state.statuses.items()}
+
+
+def save_snapshot(path: str, backend: StorageBackend) -> None:
+    """Writes the last known statuses of every category to disk.
+
+    Args:
+        path: Where to write the snapshot.
+        backend: The storage the states mirror.
+    """
+    with _states_lock:
+        snapshot: dict = {
+            "saved": datetime.now().isoformat(timespec="seconds"),
+            "sheets": {
+                category: {
+                    "title": backend.source(category),
+                    "statuses": {name: [cell.row, cell.value] for name, cell in state.statuses.items()},
+                }
+                for category, state in ((c, sheet_state(c)) for c in backend.categories())
+            },
+        }
+
+    # Write then rename so a crash never leaves a half written snapshot
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(snapshot, f)
+
+    os.replace(f"{path}.tmp", path)
+
+
+def load_snapshot(path: str, backend: StorageBackend) -> bool:
+    """Fills the category states from a snapshot written by save_snapshot.
+
+    States loaded this way are marked stale so the first flush re-reads the storage
+    unless a background refresh has already done so.
+
+    Args:
+        path: Where the snapshot was written.
+        backend: The storage the states mirror.
+
+    Returns:
+        True if every category was found in the snapshot and came from the same storage.
+    """
+    try:
+        with open(path, "r") as f:
+            snapshot: dict = json.load(f)["sheets"]
+
+    except (OSError, ValueError, KeyError):
+        return False
+
+    categories: list[str] = backend.categories()
+    if any(c not in snapshot or snapshot[c]["title"] != backend.source(c) for c in categories):
+        return False
+
+    with _states_lock:
+        for category in categories:
+            state: SheetState = sheet_state(category)
+            state.statuses = {name: Cell(row, 8, value) for name, (row, value) in snapshot[category]["statuses"].items()}
+            state.stale = True
+
+    return True
+
+
+def update(entries: list[dict[str, str]], backend: StorageBackend) -> BatchResult:
+    """Update a Google Sheets document, or whichever storage stands in for it.
+
+    The log rows and status changes for every category are sent in a single commit. For the
+    spreadsheet that is one read of where each log ends and one values_batch_update request.
+    Writes that fail are reported so only their entries are retried.
 
     Args:
         entries: The data entry to update.
-        sheets: The Google Sheets document.
+        backend: The storage to write to.
+
+    Returns:
+        Which writes went through and which entries need to be queued again.
     """
     tc.print_ok("Updating sheet")
 
     # Separate data format to sort the scans in the queue
-    entry_groups = {
-        "chromebook": [],
-        "calculator": [],
-        "religion": [],
-        "science": [],
-    }
+    entry_groups: dict[str, list[dict[str, str]]] = {category: [] for category in backend.categories()}
 
-    # Sort out the entries
+    # Sort out the entries, older journals may hold entries without a category or with one since removed
     for entry in entries:
-        if "CALC" in entry["device"]:
-            entry_groups["calculator"].append(entry)
-        elif "REL7" in entry["device"]:
-            entry_groups["religion"].append(entry)
-        elif "SCI8" in entry["device"]:
-            entry_groups["science"].append(entry)
-        else:
-            entry_groups["chromebook"].append(entry)
-            # entry_groups["testing"].append(entry)
-
-    # Run through each of the sheets and push updates for each if there are any updates
-    for s, e in entry_groups.items():
-        if len(e) == 0:
-            continue
-
-        sheet = sheets[s]
-        status_cells: dict[str, Cell] = pull_statuses(sheet)
-
-        # Grab last row + 1 from A to E, using A as search column
-        data_lr: int = len(sheet.col_values(1))
-
-        # Create an empty list to hold the cell objects
-        cells_to_update: list[Cell] = []
-        for i, entry in enumerate(e):
-            status_cells[entry["device"]].value = entry["action"]
-            entry_cells = sheet.range(f"A{data_lr + i + 1}:E{data_lr + i + 1}")
-            entry_cells[0].value = entry["device"]
-            entry_cells[1].value = entry["action"]
-            entry_cells[2].value = entry["student"]
-            entry_cells[3].value = entry["date"]
-            entry_cells[4].value = entry["time"]
-            cells_to_update.extend(entry_cells)
-
-        cells_to_update.extend(status_cells.values())
-        sheet.update_cells(cells_to_update)
-
-    tc.print_ok("Finished updating sheet")
+        category: str | None = entry.get("category")
+        entry_groups[category if category in entry_groups else route(entry["device"])].append(entry)
+
+    calls_before: int = sum(scheduler.calls.values())
+    with _states_lock, metrics.timer("sheets.update"):
+        result: BatchResult = _push(entry_groups, backend)
+
+    calls: int = sum(scheduler.calls.values()) - calls_before
+    metrics.count("sheets.entries", len(entries))
+    metrics.count("sheets.api_calls", calls)
+    metrics.gauge("sheets.last_api_calls", calls)
+    return result
+
+
+def _push(entry_groups: dict[str, list[dict[str, str]]], backend: StorageBackend) -> BatchResult:
+    """Plans and commits one batch for the grouped entries. Must be called with the states lock held.
+
+    Args:
+        entry_groups: Category name mapped to its entries, oldest first.
+        backend: The storage to write to.
+
+    Returns:
+        Which writes went through and which entries need to be queued again.
+    """
+    result: BatchResult = BatchResult()
+    groups: dict[str, list[dict[str, str]]] = {
+        category: e for category, e in entry_groups.items() if len(e) > 0 or len(sheet_state(category).unwritten) > 0
+    }
+    if len(groups) == 0:
+        return result
+
+    # Re-read every category that drifted in one request before planning
+    drifted: list[str] = [category for category, e in groups.items() if sheet_state(category).drifted(e)]
+    if len(drifted) > 0:
+        load_all(backend, drifted)
+
+    planned: list[tuple[SheetState, dict]] = [
+        (sheet_state(category), write) for category, e in groups.items() for write in sheet_state(category).plan(e)
+    ]
+    if len(planned) == 0:
+        return result
+
+    outcomes: list[bool] = backend.commit([write for _, write in planned])
+    for (state, write), ok in zip(planned, outcomes):
+        state.apply(write, ok)
+        (result.succeeded if ok else result.failed).append(backend.describe(write))
+        if not ok and write["kind"] == "log":
+            result.retry.extend(write["entries"])
+
+    if len(result.failed) == 0:
+        tc.print_ok("Finished updating sheet")
+
+    else:
+        tc.print_warning(f"{len(result.failed)} of {len(planned)} writes failed. {len(result.retry)} scans will be retried")
+
+    return result
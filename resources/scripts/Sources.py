@@ -0,0 +1,408 @@
+import os
+import cv2
+import numpy as np
+from hashlib import sha256
+from abc import ABC, abstractmethod
+
+# Folders of printed device codes the synthetic source draws cards from
+CODE_FOLDERS: tuple[str, ...] = ("chromebooks", "calcs", "textbooks")
+
+IMAGE_TYPES: tuple[str, ...] = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+class FrameSource(ABC):
+    """Where Camera gets its frames from.
+
+    Live sources pace themselves. Recorded and generated ones report the rate they were made at
+    in fps, which Camera uses to replay them in real time, or ignores to replay them as fast as
+    the scanner can take frames.
+    """
+    name: str = "source"
+    fps: float = 30.0
+    live: bool = False
+
+    def open(self) -> bool:
+        """Gets the source ready to produce frames.
+
+        Returns:
+            Whether it can produce frames.
+        """
+        return True
+
+    @abstractmethod
+    def read(self) -> np.ndarray | None:
+        """Produces the next frame.
+
+        Returns:
+            The BGR frame, or None once the source has no more frames or stopped working.
+        """
+
+    def close(self) -> None:
+        """Releases whatever the source holds open."""
+
+
+class CameraSource(FrameSource):
+    live: bool = True
+
+    def __init__(self, index: int = 0):
+        """Initializes a source reading from a camera device.
+
+        Args:
+            index: The index of the camera device to open.
+        """
+        self.index: int = index
+        self.name: str = f"camera {index}"
+        self.cam: cv2.VideoCapture | None = None
+
+    def open(self) -> bool:
+        self.cam = cv2.VideoCapture(self.index)
+        return self.cam.isOpened()
+
+    def read(self) -> np.ndarray | None:
+        ok, frame = self.cam.read()
+        return frame if ok else None
+
+    def close(self) -> None:
+        if self.cam is not None:
+            self.cam.release()
+
+
+class VideoSource(FrameSource):
+    def __init__(self, path: str, loop: bool = False):
+        """Initializes a source replaying a recorded video file.
+
+        Args:
+            path: The video file.
+            loop: Whether to start over at the end instead of finishing.
+        """
+        self.path: str = path
+        self.loop: bool = loop
+        self.name: str = os.path.basename(path)
+        self.cam: cv2.VideoCapture | None = None
+
+    def open(self) -> bool:
+        self.cam = cv2.VideoCapture(self.path)
+        self.fps = self.cam.get(cv2.CAP_PROP_FPS) or 30.0
+        return self.cam.isOpened()
+
+    def read(self) -> np.ndarray | None:
+        ok, frame = self.cam.read()
+        if not ok and self.loop:
+            self.cam.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cam.read()
+
+        return frame if ok else None
+
+    def close(self) -> None:
+        if self.cam is not None:
+            self.cam.release()
+
+
+class ImageDirSource(FrameSource):
+    def __init__(self, path: str, fps: float = 10.0, loop: bool = False):
+        """Initializes a source replaying a directory of images in name order.
+
+        Args:
+            path: The directory. Files that are not images, or cannot be read, are skipped.
+            fps: The rate the images are replayed at in real time.
+            loop: Whether to start over at the end instead of finishing.
+        """
+        self.path: str = path
+        self.fps: float = fps
+        self.loop: bool = loop
+        self.name: str = os.path.basename(os.path.normpath(path))
+        self.files: list[str] = []
+        self.position: int = 0
+
+    def open(self) -> bool:
+        self.files = [
+            os.path.join(self.path, file) for file in sorted(os.listdir(self.path))
+            if file.lower().endswith(IMAGE_TYPES)
+        ]
+        self.position = 0
+        return len(self.files) > 0
+
+    def read(self) -> np.ndarray | None:
+        skipped: int = 0
+        while skipped < len(self.files):
+            if self.position >= len(self.files):
+                if not self.loop:
+                    return None
+
+                self.position = 0
+
+            frame: np.ndarray | None = cv2.imread(self.files[self.position])
+            self.position += 1
+            if frame is not None:
+                return frame
+
+            skipped += 1
+
+        return None
+
+
+class SyntheticSource(FrameSource):
+    def __init__(self, cards: int | None = 20, size: tuple[int, int] = (640, 480), fps: float = 30.0,
+                 seed: int = 0, directory: str = "resources/qr_codes", blur: bool = True, ids: str = ""):
+        """Initializes a source that films printed device codes being held up to a camera.
+
+        Each card slides in from an edge, is held with a slightly shaking hand, and slides out
+        again before the next one, over a blurred, uneven background with sensor noise. Moving
+        cards are motion blurred along their direction of travel. The same seed always produces
+        the same frames, and the code on every card shown is kept in shown so scans can be
+        checked against it.
+
+        Args:
+            cards: How many cards to show before finishing. None never finishes.
+            size: The (width, height) of the frames.
+            fps: The rate the frames are made at, which sets how far cards move per frame.
+            seed: Seed for the random cards, paths and backgrounds.
+            directory: The folder holding the CODE_FOLDERS of PNGs.
+            blur: Whether to motion blur moving cards.
+            ids: "after" to show a student ID after every device, like the two-step checkout, or
+                "together" to hold it up next to the device. The made up students are kept in students,
+                hash mapped to name like the validation store, and the IDs shown in shown_ids.
+        """
+        self.cards: int | None = cards
+        self.size: tuple[int, int] = size
+        self.fps: float = fps
+        self.seed: int = seed
+        self.directory: str = directory
+        self.blur: bool = blur
+        self.ids: str = ids
+        self.name: str = f"synthetic {seed}"
+        self.rng: np.random.Generator = np.random.default_rng(seed)
+        self.codes: list[tuple[str, np.ndarray]] = []
+        self.students: dict[str, str] = {}
+        self.id_cards: list[tuple[str, np.ndarray]] = []
+        self.backgrounds: list[np.ndarray] = []
+        self.noise: list[tuple[np.ndarray, np.ndarray]] = []
+        self.shown: list[str] = []
+        self.shown_ids: list[str] = []
+        self.showing: str = ""
+        self.path: list[tuple[float, float, float, float]] = []
+        self.last: tuple[float, float, float, float] | None = None
+        self.background: np.ndarray | None = None
+        self.frame_index: int = 0
+        self.order: list[int] = []
+        self.label: str = ""
+        self.pending: tuple[str, np.ndarray] | None = None
+
+        # The cards currently held up: the image, an opaque mask the same size, and the sideways offset
+        # of its centre from the hand's position in card widths
+        self.in_view: list[tuple[np.ndarray, np.ndarray, float]] = []
+
+    def open(self) -> bool:
+        for folder in CODE_FOLDERS:
+            folder_path: str = os.path.join(self.directory, folder)
+            if not os.path.isdir(folder_path):
+                continue
+
+            for file in sorted(os.listdir(folder_path)):
+                image: np.ndarray | None = cv2.imread(os.path.join(folder_path, file)) if file.endswith(".png") else None
+                if image is not None:
+                    self.codes.append((file.removesuffix(".png"), image))
+
+        if self.ids != "":
+            encoder: cv2.QRCodeEncoder = cv2.QRCodeEncoder.create()
+            for i in range(40):
+                name: str = f"Student {i:02d}"
+                data: str = sha256(name.encode()).hexdigest()
+                modules: np.ndarray = encoder.encode(data)
+                card: np.ndarray = cv2.resize(modules, None, fx=8, fy=8, interpolation=cv2.INTER_NEAREST)
+                card = cv2.copyMakeBorder(card, 32, 32, 32, 32, cv2.BORDER_CONSTANT, value=255)
+                self.students[data] = name
+                self.id_cards.append((data, cv2.cvtColor(card, cv2.COLOR_GRAY2BGR)))
+
+        width, height = self.size
+        for _ in range(4):
+            # Large, soft, muted blobs stand in for a room out of focus behind the cards
+            coarse: np.ndarray = self.rng.integers(50, 200, (6, 8, 1)) + self.rng.integers(-25, 25, (6, 8, 3))
+            self.backgrounds.append(cv2.GaussianBlur(
+                cv2.resize(coarse.astype(np.uint8), (width, height), interpolation=cv2.INTER_CUBIC), (0, 0), 25
+            ))
+
+        for _ in range(4):
+            grain: np.ndarray = self.rng.normal(0, 4, (height, width, 3))
+            self.noise.append((np.clip(grain, 0, 255).astype(np.uint8), np.clip(-grain, 0, 255).astype(np.uint8)))
+
+        return len(self.codes) > 0
+
+    def _next_card(self) -> bool:
+        """Picks the next card, and ID if shown, and plans their path in and out of view.
+
+        Returns:
+            False once every card has been shown.
+        """
+        if self.cards is not None and len(self.shown) >= self.cards and self.pending is None:
+            return False
+
+        width, height = self.size
+        card_size: float = float(self.rng.uniform(0.55, 1.0)) * min(width, height) * 0.75
+        spread: float = 0.12
+        self.background = self.backgrounds[int(self.rng.integers(len(self.backgrounds)))]
+
+        # The ID that goes with the device just shown
+        if self.pending is not None:
+            self.label, id_card = self.pending
+            self.in_view = [(id_card, np.full(id_card.shape[:2], 255, dtype=np.uint8), 0.0)]
+            self.pending = None
+            self._plan(card_size, spread)
+            return True
+
+        # Every code is used once before any repeats, and never twice in a row
+        if len(self.order) == 0:
+            self.order = self.rng.permutation(len(self.codes)).tolist()
+            if len(self.shown) > 0 and len(self.codes) > 1 and self.codes[self.order[-1]][0] == self.shown[-1]:
+                self.order.insert(0, self.order.pop())
+
+        self.label, code = self.codes[self.order.pop()]
+        self.shown.append(self.label)
+        self.in_view = [(code, np.full(code.shape[:2], 255, dtype=np.uint8), 0.0)]
+        if self.ids == "after":
+            self.pending = self.id_cards[int(self.rng.integers(len(self.id_cards)))]
+            self.shown_ids.append(self.pending[0])
+
+        elif self.ids == "together":
+            data, id_card = self.id_cards[int(self.rng.integers(len(self.id_cards)))]
+            self.shown_ids.append(data)
+            self.in_view.append((id_card, np.full(id_card.shape[:2], 255, dtype=np.uint8), 0.0))
+
+            # Two smaller cards side by side, in either order, with a little gap between them
+            card_size = float(self.rng.uniform(0.6, 0.8)) * min(width / 2, height) * 0.85
+            side: float = 0.55 if self.rng.random() < 0.5 else -0.55
+            self.in_view = [(image, mask, side * (1 if i == 0 else -1)) for i, (image, mask, _) in enumerate(self.in_view)]
+            spread = 0.05
+
+        self._plan(card_size, spread)
+        return True
+
+    def _plan(self, card_size: float, spread: float) -> None:
+        """Plans the path of the cards in view: in from an edge, held up, out again, then a pause.
+
+        Args:
+            card_size: The size of each card's longer side in pixels.
+            spread: How far from the centre of the frame the cards may be held, as a fraction of its size.
+        """
+        width, height = self.size
+        angle: float = float(self.rng.uniform(-20, 20))
+        rest: np.ndarray = np.array([width, height]) * (0.5 + self.rng.uniform(-spread, spread, 2))
+        direction: float = float(self.rng.uniform(0, 2 * np.pi))
+        away: np.ndarray = rest + np.array([np.cos(direction), np.sin(direction)]) * (width + height) / 2
+
+        # Seconds spent sliding in, held up, sliding out, and with nothing in view
+        enter, hold, leave, gap = (max(1, int(self.fps * s)) for s in (0.4, float(self.rng.uniform(0.8, 1.6)), 0.4, 0.3))
+        self.path = []
+        for i in range(enter):
+            t: float = 1 - (1 - (i + 1) / enter) ** 2
+            x, y = away + (rest - away) * t
+            self.path.append((x, y, angle * t, card_size))
+
+        for i in range(hold):
+            shake: np.ndarray = self.rng.normal(0, 1.5, 2)
+            self.path.append((rest[0] + shake[0], rest[1] + shake[1], angle + float(self.rng.normal(0, 0.5)), card_size))
+
+        for i in range(leave):
+            t = ((i + 1) / leave) ** 2
+            x, y = rest + (away - rest) * t
+            self.path.append((x, y, angle * (1 - t), card_size))
+
+        self.path.extend([(float("nan"), 0.0, 0.0, 0.0)] * gap)
+        self.path.reverse()
+
+    def read(self) -> np.ndarray | None:
+        if len(self.path) == 0 and not self._next_card():
+            return None
+
+        previous: tuple[float, float, float, float] | None = self.last
+        x, y, angle, card_size = self.last = self.path.pop()
+        self.frame_index += 1
+        grain_add, grain_sub = self.noise[self.frame_index % len(self.noise)]
+        frame: np.ndarray = cv2.add(self.background, grain_add)
+
+        # Between cards there is only the background
+        if np.isnan(x):
+            self.showing = ""
+            return cv2.subtract(frame, grain_sub, dst=frame)
+
+        self.showing = self.label
+
+        # Smear the cards along the way they are moving, by about the distance they cover in a frame
+        kernel: np.ndarray | None = None
+        if self.blur and previous is not None and not np.isnan(previous[0]):
+            dx, dy = previous[0] - x, previous[1] - y
+            distance: float = float(np.hypot(dx, dy))
+            if distance >= 2:
+                reach: int = min(int(distance / 2), 15)
+                dx, dy = dx / distance * reach, dy / distance * reach
+                kernel = np.zeros((reach * 2 + 1, reach * 2 + 1), dtype=np.float32)
+                cv2.line(kernel, (reach - round(dx), reach - round(dy)), (reach + round(dx), reach + round(dy)), 1.0)
+                kernel /= kernel.sum()
+
+        for image, solid, offset in self.in_view:
+            height, width = image.shape[:2]
+            transform: np.ndarray = cv2.getRotationMatrix2D((width / 2, height / 2), angle, card_size / max(width, height))
+
+            # Cards held side by side are offset along their own, rotated, width
+            sideways: np.ndarray = transform[:, 0] / np.hypot(*transform[:, 0]) * offset * (card_size + 20)
+            transform[:, 2] += (x - width / 2 + sideways[0], y - height / 2 + sideways[1])
+            self._composite(frame, image, solid, transform, kernel)
+
+        return cv2.subtract(frame, grain_sub, dst=frame)
+
+    def _composite(self, frame: np.ndarray, image: np.ndarray, solid: np.ndarray, transform: np.ndarray,
+                   kernel: np.ndarray | None) -> None:
+        """Draws one card onto a frame, only touching the part of the frame it covers.
+
+        Args:
+            frame: The frame, drawn on in place.
+            image: The card.
+            solid: An opaque mask the size of the card.
+            transform: The affine transform placing the card in the frame.
+            kernel: The motion blur kernel, or None for a still card.
+        """
+        height, width = image.shape[:2]
+        corners: np.ndarray = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]]) @ transform.T
+        pad: int = 2 + (kernel.shape[0] if kernel is not None else 0)
+        x0, y0 = np.maximum(np.floor(corners.min(axis=0)).astype(int) - pad, 0)
+        x1, y1 = np.minimum(np.ceil(corners.max(axis=0)).astype(int) + pad, self.size)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        placed: np.ndarray = transform.copy()
+        placed[:, 2] -= (x0, y0)
+        layer: np.ndarray = cv2.warpAffine(image, placed, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR)
+        mask: np.ndarray = cv2.warpAffine(solid, placed, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR)
+        if kernel is not None:
+            layer = cv2.filter2D(layer, -1, kernel)
+            mask = cv2.filter2D(mask, -1, kernel)
+
+        alpha: np.ndarray = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR).astype(np.float32) * (1 / 255)
+        region: np.ndarray = frame[y0:y1, x0:x1]
+        region[:] = region * (1 - alpha) + layer * alpha
+
+
+def open_source(spec: str, loop: bool = False) -> FrameSource:
+    """Builds a frame source from a command line argument.
+
+    Args:
+        spec: A camera index, a directory of images, a video file, or "synthetic" for generated devices.
+            "synthetic-ids" shows a student ID after each device and "synthetic-pairs" next to it.
+            ":<cards>" after any of the three sets how many devices are shown.
+        loop: Whether recordings start over at the end instead of finishing.
+
+    Returns:
+        The source, not opened yet.
+    """
+    if spec.isdigit():
+        return CameraSource(int(spec))
+
+    kind, _, cards = spec.partition(":")
+    if kind in ("synthetic", "synthetic-ids", "synthetic-pairs"):
+        ids: str = {"synthetic": "", "synthetic-ids": "after", "synthetic-pairs": "together"}[kind]
+        return SyntheticSource(cards=int(cards) if cards != "" else None, ids=ids)
+
+    if os.path.isdir(spec):
+        return ImageDirSource(spec, loop=loop)
+
+    return VideoSource(spec, loop=loop)
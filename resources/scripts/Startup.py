@@ -0,0 +1,83 @@
+import time
+import threading as th
+from typing import Any, Callable
+from contextlib import contextmanager
+from collections.abc import Iterator
+
+
+class StartupProfile:
+    def __init__(self):
+        """Initializes the record of how long each step of startup takes and on which thread.
+
+        The clock starts when this module is first imported, so main.py imports it before anything
+        else and the time spent importing shows up as its own step.
+        """
+        self.started: float = time.perf_counter()
+        self.lock: th.Lock = th.Lock()
+        self.phases: list[tuple[str, str, float, float]] = []
+
+    def mark(self, name: str) -> None:
+        """Records a step that ran from the start of the clock until now, such as the imports.
+
+        Args:
+            name: The step.
+        """
+        with self.lock:
+            self.phases.append((name, th.current_thread().name, 0.0, time.perf_counter() - self.started))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Records how long the body of a with block takes, including when it raises.
+
+        Args:
+            name: The step, e.g. "sheets".
+        """
+        start: float = time.perf_counter() - self.started
+        try:
+            yield
+
+        finally:
+            with self.lock:
+                self.phases.append((name, th.current_thread().name, start, time.perf_counter() - self.started))
+
+    def timed(self, name: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """Runs a function as a recorded step. Meant to be handed to an executor to overlap steps.
+
+        Args:
+            name: The step.
+            fn: The function to run.
+            *args: Arguments for fn.
+
+        Returns:
+            Whatever fn returns.
+        """
+        with self.phase(name):
+            return fn(*args)
+
+    def report(self, width: int = 40) -> list[str]:
+        """Returns the recorded steps as a table with a timeline, in the order they started.
+
+        Args:
+            width: Characters used for the timeline bars.
+
+        Returns:
+            One line per step, after a line with the total.
+        """
+        with self.lock:
+            phases: list[tuple[str, str, float, float]] = sorted(self.phases, key=lambda phase: (phase[2], phase[3]))
+
+        total: float = max((end for _, _, _, end in phases), default=0.0)
+        serial: float = sum(end - start for _, _, start, end in phases)
+        scale: float = width / total if total > 0 else 0.0
+        lines: list[str] = [
+            f"Ready after {total:.3f} s. One after another the steps would take {serial:.3f} s",
+            f"  {'step':<16} {'thread':<12} {'start':>7} {'took':>7}",
+        ]
+        for name, thread, start, end in phases:
+            bar: str = " " * int(start * scale) + "#" * max(1, int((end - start) * scale))
+            lines.append(f"  {name:<16} {thread[:12]:<12} {start:>7.3f} {end - start:>7.3f}  {bar}")
+
+        return lines
+
+
+startup = StartupProfile()
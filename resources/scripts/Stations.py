@@ -0,0 +1,150 @@
+import cv2
+import queue
+import multiprocessing as mp
+from gspread import Cell
+from resources.scripts.Camera import Camera
+from resources.scripts.Logging import write_log
+from resources.scripts.Metrics import metrics
+from resources.scripts.Registry import DeviceRegistry
+from resources.scripts.TermColor import TermColor
+from resources.scripts.QRProcessor import QRProcessor
+from resources.scripts.Validation import validation
+from resources.scripts.Writer import SheetWriter, make_entry
+from resources.scripts.Exceptions import BadOrderException, UnknownQRCodeException, StopExecution
+
+tc = TermColor()
+
+
+def run_station(index: int, devices: dict[str, str], scans: mp.Queue, replies: mp.Queue) -> None:
+    """Runs the Rental/ID scanning flow for one camera. This is the body of each station process.
+
+    The station only decodes. Every completed scan is sent to the coordinator, which owns the
+    device statuses and the sheet writer, and the station waits for the resulting action.
+
+    Args:
+        index: The camera index, also used to tell stations apart.
+        devices: Device name mapped to its category, used to recognize device codes.
+        scans: Where completed scans are sent as ("scan", index, device, student).
+            ("stopped", index, None, None) is sent when the station exits.
+        replies: This station's replies from the coordinator, the device's new status or None if it is unknown.
+    """
+    registry: DeviceRegistry = DeviceRegistry()
+    for device, category in devices.items():
+        registry.load(category, {device: Cell(0, 8, "")})
+
+    # Each station measures its own capture, decode and render stages
+    metrics.start(f"logs/metrics_station_{index}.jsonl")
+    camera: Camera = Camera(index).start()
+    qr_proc: QRProcessor = QRProcessor(validation, camera, window=f"Scanner {index}")
+    tc.print_ok(f"Station {index} ready")
+
+    try:
+        while True:
+            try:
+                device: str = qr_proc.process_code(qr_proc.read_code("Show Rental", registry), registry, "rental")
+                student: str = qr_proc.process_code(qr_proc.read_code("Show ID", registry), registry, "student")
+
+                scans.put(("scan", index, device, student))
+                action: str | None = replies.get()
+                if action is None:
+                    print(f"Station {index}: Unknown device scanned.")
+                    continue
+
+                qr_proc.notify(f"{device} checked {action}", 1.5)
+
+            except cv2.error:
+                tc.print_warning("OpenCV threw some errors, can likely ignore")
+
+            except (BadOrderException, UnknownQRCodeException):
+                continue
+
+    except StopExecution:
+        pass
+
+    except (Exception,):
+        tc.print_fatal(f"Station {index} stopped on an unknown error. See logs for more details.")
+        write_log()
+
+    finally:
+        scans.put(("stopped", index, None, None))
+        qr_proc.close()
+        camera.release()
+        metrics.stop()
+        cv2.destroyAllWindows()
+
+
+class StationCoordinator:
+    def __init__(self, indexes: list[int], registry: DeviceRegistry, writer: SheetWriter):
+        """Initializes one scanning station process per camera, all sharing one device registry and sheet writer.
+
+        Stations decode in their own processes so they scale with cores. Device statuses are only
+        toggled here, one scan at a time, so two lines renting the same device cannot both win, and
+        every scan goes through the single writer so API usage stays that of one scanner.
+
+        Args:
+            indexes: The camera index of each station.
+            registry: The device statuses shared by every station.
+            writer: The writer every scan is queued on.
+        """
+        self.indexes: list[int] = indexes
+        self.registry: DeviceRegistry = registry
+        self.writer: SheetWriter = writer
+
+        # Spawned rather than forked, the parent already runs the writer and journal threads
+        self.context = mp.get_context("spawn")
+        self.scans: mp.Queue = self.context.Queue()
+        self.replies: dict[int, mp.Queue] = {index: self.context.Queue() for index in indexes}
+        self.processes: dict[int, mp.Process] = {}
+
+    def start(self) -> "StationCoordinator":
+        """Starts every station process.
+
+        Returns:
+            The coordinator itself.
+        """
+        devices: dict[str, str] = {device: self.registry.category_of(device) for device in self.registry}
+        for index in self.indexes:
+            process: mp.Process = self.context.Process(
+                target=run_station, name=f"station-{index}", daemon=True,
+                args=(index, devices, self.scans, self.replies[index])
+            )
+            process.start()
+            self.processes[index] = process
+
+        return self
+
+    def run(self) -> None:
+        """Records scans from the stations until every station has stopped."""
+        running: set[int] = set(self.indexes)
+        while len(running) > 0:
+            try:
+                kind, index, device, student = self.scans.get(timeout=1.0)
+
+            except queue.Empty:
+                # A station that crashed hard never says it stopped
+                running = {index for index in running if self.processes[index].is_alive()}
+                continue
+
+            if kind == "stopped":
+                running.discard(index)
+                tc.print_ok(f"Station {index} stopped")
+                continue
+
+            if device not in self.registry:
+                self.replies[index].put(None)
+                continue
+
+            action: str = self.registry.toggle(device)
+            self.replies[index].put(action)
+            self.writer.put(make_entry(device, student, action, self.registry.category_of(device)))
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Waits for the station processes to exit, terminating any that do not.
+
+        Args:
+            timeout: Seconds to wait for each station.
+        """
+        for process in self.processes.values():
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,373 @@
+import os
+import time
+import sqlite3
+import threading as th
+from abc import ABC, abstractmethod
+from typing import Callable
+from gspread import Cell, Spreadsheet, Worksheet
+from gspread.exceptions import APIError
+from gspread.utils import absolute_range_name
+from resources.scripts.Settings import settings
+from resources.scripts.Registry import route
+from resources.scripts.Scheduler import scheduler
+from resources.scripts.TermColor import TermColor
+
+tc = TermColor()
+
+
+class StorageBackend(ABC):
+    """Where device statuses are read from and where statuses and log rows are written to.
+
+    Writes are planned by the sync engine in Sheets as dicts of two kinds:
+        {"kind": "log", "category": ..., "entries": [entry, ...]}, appended after the last logged row
+        {"kind": "status", "category": ..., "device": ..., "row": status row, "value": "IN" or "OUT"}
+    """
+
+    @abstractmethod
+    def read(self, categories: list[str]) -> dict[str, dict[str, Cell]]:
+        """Reads the device statuses of the given categories.
+
+        Args:
+            categories: The categories to read.
+
+        Returns:
+            Category mapped to device name mapped to its status cell.
+        """
+
+    @abstractmethod
+    def commit(self, writes: list[dict]) -> list[bool]:
+        """Writes status changes and appends log rows, as one request where the backend allows it.
+
+        Args:
+            writes: The planned writes, see the class docstring.
+
+        Returns:
+            Whether each write succeeded, in the same order.
+        """
+
+    @abstractmethod
+    def source(self, category: str) -> str:
+        """Returns a name for where a category is stored. Used to tell whether a snapshot still applies."""
+
+    def describe(self, write: dict) -> str:
+        """Returns a readable label for a planned write, used when reporting failures.
+
+        Args:
+            write: A planned write.
+        """
+        if write["kind"] == "log":
+            return f"{write['category']} log, {len(write['entries'])} rows"
+
+        return f"{write['category']} status of {write['device']}"
+
+    def categories(self) -> list[str]:
+        """Returns the categories this backend stores, in the order from settings."""
+        return list(settings.get().sheets)
+
+
+class GspreadBackend(StorageBackend):
+    def __init__(self, sheets: dict[str, Worksheet]):
+        """Initializes storage on the tracker spreadsheet.
+
+        Args:
+            sheets: Category name mapped to its worksheet, as returned by Sheets.open_sheets.
+        """
+        self.sheets: dict[str, Worksheet] = sheets
+
+    def sheet(self, category: str) -> Worksheet:
+        """Returns the worksheet for a category, reopening it if its name was changed in settings.
+
+        Args:
+            category: The category to look up.
+        """
+        sheet: Worksheet = self.sheets[category]
+        title: str = settings.get().sheets.get(category, sheet.title)
+        if title != sheet.title:
+            tc.print_ok(f"Switching {category} to worksheet {title}")
+            sheet = scheduler.call("read", sheet.spreadsheet.worksheet, title)
+            self.sheets[category] = sheet
+
+        return sheet
+
+    def categories(self) -> list[str]:
+        return list(self.sheets)
+
+    def source(self, category: str) -> str:
+        return self.sheet(category).title
+
+    def read(self, categories: list[str]) -> dict[str, dict[str, Cell]]:
+        ranges: list[str] = [absolute_range_name(self.sheet(category).title, "G2:H") for category in categories]
+        spreadsheet: Spreadsheet = self.sheets[categories[0]].spreadsheet
+        value_ranges: list[dict] = scheduler.call("read", spreadsheet.values_batch_get, ranges)["valueRanges"]
+
+        tables: dict[str, dict[str, Cell]] = {}
+        for category, value_range in zip(categories, value_ranges):
+            tables[category] = {
+                # Device name (Column G) ------------maps to-----------> Device status (Column H)
+                row[0]: Cell(j + 2, 8, row[1] if len(row) > 1 else "")
+                for j, row in enumerate(value_range.get("values", [])) if len(row) > 0 and row[0] != ""
+            }
+
+        return tables
+
+    def describe(self, write: dict) -> str:
+        title: str = self.sheets[write["category"]].title
+        if write["kind"] == "log":
+            return f"{absolute_range_name(title, 'A:E')} +{len(write['entries'])} rows"
+
+        return absolute_range_name(title, f"H{write['row']}")
+
+    def commit(self, writes: list[dict]) -> list[bool]:
+        spreadsheet: Spreadsheet = self.sheets[writes[0]["category"]].spreadsheet
+        logged: list[str] = [write["category"] for write in writes if write["kind"] == "log"]
+        try:
+            # Where each log ends is read right before writing, another station or someone editing
+            # by hand may have added rows since the statuses were last read
+            next_row: dict[str, int] = {}
+            if len(logged) > 0:
+                ranges: list[str] = [absolute_range_name(self.sheets[category].title, "A:A") for category in logged]
+                value_ranges: list[dict] = scheduler.call("read", spreadsheet.values_batch_get, ranges)["valueRanges"]
+                next_row = {
+                    category: len(value_range.get("values", [])) + 1
+                    for category, value_range in zip(logged, value_ranges)
+                }
+
+            data: list[dict] = []
+            for write in writes:
+                title: str = self.sheets[write["category"]].title
+                if write["kind"] == "log":
+                    row: int = next_row[write["category"]]
+                    data.append({
+                        "range": absolute_range_name(title, f"A{row}:E{row + len(write['entries']) - 1}"),
+                        "values": [
+                            [entry["device"], entry["action"], entry["student"], entry["date"], entry["time"]]
+                            for entry in write["entries"]
+                        ],
+                    })
+
+                else:
+                    data.append({"range": absolute_range_name(title, f"H{write['row']}"), "values": [[write["value"]]]})
+
+            responses: list[dict] = scheduler.call("write", spreadsheet.values_batch_update, body={
+                "valueInputOption": "RAW",
+                "data": data,
+            }).get("responses", [])
+
+        except APIError as e:
+            tc.print_fail(f"Sheet update failed: {e}")
+            responses = []
+
+        # Responses come back in request order, a missing response means that range was not written
+        return [i < len(responses) and "updatedRange" in responses[i] for i in range(len(writes))]
+
+
+class LazyBackend(StorageBackend):
+    def __init__(self, connect: Callable[[], StorageBackend]):
+        """Initializes storage that is only opened once it can be reached, so the scanner can start offline.
+
+        Until then the categories and sources come from settings, matching what GspreadBackend
+        reports, so a snapshot saved while online still loads.
+
+        Args:
+            connect: Opens the real storage. Raises if it cannot be reached.
+        """
+        self.connect: Callable[[], StorageBackend] = connect
+        self.backend: StorageBackend | None = None
+        self.lock: th.Lock = th.Lock()
+
+    def live(self) -> StorageBackend:
+        """Returns the real storage, trying to open it if it is not open yet.
+
+        Raises:
+            Whatever connect raises when the storage cannot be reached.
+        """
+        with self.lock:
+            if self.backend is None:
+                self.backend = self.connect()
+                tc.print_ok("Connected to storage")
+
+            return self.backend
+
+    def categories(self) -> list[str]:
+        return self.backend.categories() if self.backend is not None else super().categories()
+
+    def source(self, category: str) -> str:
+        return self.backend.source(category) if self.backend is not None else settings.get().sheets[category]
+
+    def describe(self, write: dict) -> str:
+        return self.backend.describe(write) if self.backend is not None else super().describe(write)
+
+    def read(self, categories: list[str]) -> dict[str, dict[str, Cell]]:
+        return self.live().read(categories)
+
+    def commit(self, writes: list[dict]) -> list[bool]:
+        return self.live().commit(writes)
+
+
+class SQLiteBackend(StorageBackend):
+    def __init__(self, path: str):
+        """Initializes storage in a local SQLite database, creating the tables if needed.
+
+        Args:
+            path: The database file, or ":memory:".
+        """
+        self.path: str = path
+        self.lock: th.Lock = th.Lock()
+        self.db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS devices (
+                name TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS log (
+                id INTEGER PRIMARY KEY,
+                category TEXT NOT NULL,
+                device TEXT NOT NULL,
+                action TEXT NOT NULL,
+                student TEXT NOT NULL,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS log_category ON log (category);
+        """)
+        self.db.commit()
+
+    def add_devices(self, category: str, names: list[str], status: str = "IN") -> None:
+        """Adds devices that are not stored yet.
+
+        Args:
+            category: The category the devices belong to.
+            names: The device names.
+            status: The status new devices start with.
+        """
+        with self.lock:
+            start: int = self.db.execute(
+                "SELECT COALESCE(MAX(row), 1) FROM devices WHERE category = ?", (category,)
+            ).fetchone()[0]
+            self.db.executemany(
+                "INSERT OR IGNORE INTO devices (name, category, row, status) VALUES (?, ?, ?, ?)",
+                [(name, category, start + i + 1, status) for i, name in enumerate(names)]
+            )
+            self.db.commit()
+
+    def source(self, category: str) -> str:
+        return f"sqlite:{os.path.abspath(self.path)}"
+
+    def read(self, categories: list[str]) -> dict[str, dict[str, Cell]]:
+        with self.lock:
+            tables: dict[str, dict[str, Cell]] = {}
+            for category in categories:
+                tables[category] = {
+                    name: Cell(row, 8, status) for name, row, status in self.db.execute(
+                        "SELECT name, row, status FROM devices WHERE category = ?", (category,)
+                    )
+                }
+
+            return tables
+
+    def commit(self, writes: list[dict]) -> list[bool]:
+        with self.lock:
+            try:
+                for write in writes:
+                    if write["kind"] == "log":
+                        self.db.executemany(
+                            "INSERT INTO log (category, device, action, student, date, time) VALUES (?, ?, ?, ?, ?, ?)",
+                            [(write["category"], e["device"], e["action"], e["student"], e["date"], e["time"])
+                             for e in write["entries"]]
+                        )
+
+                    else:
+                        self.db.execute("UPDATE devices SET status = ? WHERE name = ?", (write["value"], write["device"]))
+
+                self.db.commit()
+                return [True] * len(writes)
+
+            except sqlite3.Error as e:
+                self.db.rollback()
+                tc.print_fail(f"Database update failed: {e}")
+                return [False] * len(writes)
+
+
+class MemoryBackend(StorageBackend):
+    def __init__(self, latency: float = 0.0):
+        """Initializes an in-memory stand-in for the spreadsheet.
+
+        Args:
+            latency: Seconds each read or commit sleeps for, to imitate a network round trip.
+        """
+        self.latency: float = latency
+        self.lock: th.Lock = th.Lock()
+        self.statuses: dict[str, dict[str, Cell]] = {}
+        self.logs: dict[str, list[list[str]]] = {}
+        self.requests: int = 0
+        self.cells_written: int = 0
+
+    def add_devices(self, category: str, names: list[str], status: str = "IN") -> None:
+        """Adds devices that are not stored yet.
+
+        Args:
+            category: The category the devices belong to.
+            names: The device names.
+            status: The status new devices start with.
+        """
+        with self.lock:
+            table: dict[str, Cell] = self.statuses.setdefault(category, {})
+            self.logs.setdefault(category, [["Device", "Action", "Student", "Date", "Time"]])
+            for name in names:
+                if name not in table:
+                    table[name] = Cell(len(table) + 2, 8, status)
+
+    def source(self, category: str) -> str:
+        return f"memory:{id(self)}"
+
+    def read(self, categories: list[str]) -> dict[str, dict[str, Cell]]:
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            return {
+                category: {name: Cell(cell.row, cell.col, cell.value) for name, cell in self.statuses.get(category, {}).items()}
+                for category in categories
+            }
+
+    def commit(self, writes: list[dict]) -> list[bool]:
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            for write in writes:
+                if write["kind"] == "log":
+                    self.logs.setdefault(write["category"], []).extend(
+                        [e["device"], e["action"], e["student"], e["date"], e["time"]] for e in write["entries"]
+                    )
+
+                    self.cells_written += 5 * len(write["entries"])
+
+                else:
+                    self.statuses[write["category"]][write["device"]].value = write["value"]
+                    self.cells_written += 1
+
+            return [True] * len(writes)
+
+
+def seed_from_codes(backend: SQLiteBackend | MemoryBackend, directory: str = "resources/qr_codes") -> None:
+    """Adds a device for every QR code image in the device folders, routed to a category by prefix.
+
+    Lets the local backends start with the same inventory as the printed codes.
+
+    Args:
+        backend: The backend to fill.
+        directory: The folder holding one sub folder of PNGs per kind of device.
+    """
+    grouped: dict[str, list[str]] = {}
+    for folder in sorted(os.listdir(directory)):
+        if not os.path.isdir(os.path.join(directory, folder)) or folder == "output":
+            continue
+
+        for file in sorted(os.listdir(os.path.join(directory, folder))):
+            if file.endswith(".png"):
+                name: str = file.removesuffix(".png")
+                grouped.setdefault(route(name), []).append(name)
+
+    for category, names in grouped.items():
+        backend.add_devices(category, names)
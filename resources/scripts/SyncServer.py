@@ -0,0 +1,188 @@
+import json
+import zlib
+import base64
+import argparse
+import threading as th
+from hashlib import sha256
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from resources.scripts.AWS import PROTOCOL, DOCUMENTS, content_hash
+from resources.scripts.TermColor import TermColor
+
+tc = TermColor()
+
+
+class SyncServer:
+    def __init__(self, password: str, documents: dict[str, dict] | None = None, host: str = "127.0.0.1",
+                 port: int = 0):
+        """Initializes a local stand-in for the two AWS Lambda endpoints used by AWS.py.
+
+        /pull answers like the pull Lambda and /push like the push Lambda. Both understand the
+        original form posts as well as the compressed, hash checked requests of the sync protocol,
+        so either kind of client can be tested against it. Documents are only kept in memory.
+
+        Args:
+            password: The password clients must send, before hashing.
+            documents: The starting "apikey" and "validation" documents.
+            host: The address to listen on.
+            port: The port to listen on. 0 picks a free one.
+        """
+        self.password_hash: str = sha256(password.encode()).hexdigest()
+        self.documents: dict[str, dict] = {"apikey": {}, "validation": {}, **(documents or {})}
+        self.lock: th.Lock = th.Lock()
+        self.requests: list[dict] = []
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self._handler())
+        self.thread: th.Thread | None = None
+
+    @property
+    def pull_url(self) -> str:
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/pull"
+
+    @property
+    def push_url(self) -> str:
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/push"
+
+    def start(self) -> None:
+        """Starts serving on a background thread."""
+        self.thread = th.Thread(target=self.server.serve_forever, name="sync-server", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stops serving and closes the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def pull(self, form: dict[str, str]) -> tuple[int, dict | str]:
+        """Answers a pull request.
+
+        Args:
+            form: The posted form fields.
+
+        Returns:
+            The status code and the response body.
+        """
+        if form.get("pass") != self.password_hash:
+            return 200, "Unauthorized: Bad password"
+
+        with self.lock:
+            if int(form.get("protocol", 1)) != PROTOCOL:
+                return 200, {
+                    "api_key": json.dumps(self.documents["apikey"]),
+                    "validation": json.dumps(self.documents["validation"]),
+                }
+
+            have: dict[str, str] = json.loads(form.get("have", "{}"))
+            documents: dict[str, dict] = {}
+            for kind, data in self.documents.items():
+                digest: str = content_hash(data)
+                documents[kind] = {"hash": digest} if have.get(kind) == digest else {"hash": digest, "data": data}
+
+            return 200, {"protocol": PROTOCOL, "documents": documents}
+
+    def push(self, body: dict) -> tuple[int, dict | str]:
+        """Answers a push request.
+
+        Args:
+            body: The decoded request, either form fields or a protocol request.
+
+        Returns:
+            The status code and the response body.
+        """
+        if body.get("pass") != self.password_hash:
+            return 200, "Unauthorized: Bad password"
+
+        kind: str = body["kind"]
+        with self.lock:
+            if body.get("protocol") != PROTOCOL:
+                self.documents[kind] = json.loads(base64.urlsafe_b64decode(body["data"]))
+                return 200, "Success"
+
+            current: dict = self.documents.get(kind, {})
+            if "delta" in body:
+                if body.get("base") != content_hash(current):
+                    return 409, {"protocol": PROTOCOL, "hash": content_hash(current)}
+
+                updated: dict = {**current, **body["delta"]["added"]}
+                for key in body["delta"]["removed"]:
+                    updated.pop(key, None)
+
+            else:
+                updated = body["data"]
+
+            # The client says what the document should hash to, refuse anything that does not match
+            if content_hash(updated) != body["hash"]:
+                return 409, {"protocol": PROTOCOL, "hash": content_hash(current)}
+
+            self.documents[kind] = updated
+            return 200, {"protocol": PROTOCOL, "hash": body["hash"]}
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        """Builds the request handler class bound to this server."""
+        server: SyncServer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                raw: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "deflate":
+                    raw = zlib.decompress(raw)
+
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    body: dict = json.loads(raw)
+
+                else:
+                    body = {key: values[0] for key, values in parse_qs(raw.decode("utf-8")).items()}
+
+                with server.lock:
+                    server.requests.append({"path": self.path, "bytes": len(raw), "kind": body.get("kind")})
+
+                if self.path.rstrip("/") == "/pull":
+                    status, response = server.pull(body)
+
+                elif self.path.rstrip("/") == "/push":
+                    status, response = server.push(body)
+
+                else:
+                    status, response = 404, "Not found"
+
+                payload: bytes = (json.dumps(response) if isinstance(response, dict) else response).encode()
+                compress: bool = "deflate" in self.headers.get("Accept-Encoding", "") and len(payload) > 512
+                if compress:
+                    payload = zlib.compress(payload)
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json" if isinstance(response, dict) else "text/plain")
+                if compress:
+                    self.send_header("Content-Encoding", "deflate")
+
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the AWS sync endpoints.")
+    parser.add_argument("--password", required=True, help="password clients must use")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--seed", action="store_true",
+                        help="start with the local api_key.json and validation.json")
+    args = parser.parse_args()
+
+    seeded: dict[str, dict] = {}
+    if args.seed:
+        for seed_kind, seed_path in DOCUMENTS.items():
+            with open(seed_path, "r") as seed_file:
+                seeded[seed_kind] = json.load(seed_file)
+
+    stand_in: SyncServer = SyncServer(args.password, seeded, port=args.port)
+    tc.print_ok(f"Serving {stand_in.pull_url} and {stand_in.push_url}. Point \"aws pull url\" and "
+                f"\"aws push url\" in settings.json at them")
+    try:
+        stand_in.server.serve_forever()
+
+    except KeyboardInterrupt:
+        stand_in.stop()
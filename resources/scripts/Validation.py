@@ -0,0 +1,177 @@
+import os
+import json
+import sqlite3
+import threading as th
+from collections.abc import Iterable, Iterator
+from resources.scripts.TermColor import TermColor
+
+tc = TermColor()
+
+
+class ValidationStore:
+    def __init__(self, path: str, json_path: str):
+        """Initializes an indexed store mapping student QR code hashes to student names.
+
+        The database is opened on first use. validation.json stays the format shared through AWS,
+        it is imported whenever it is newer than the last import and exported before being pushed.
+
+        Args:
+            path: The SQLite database file, or ":memory:".
+            json_path: The validation.json file the store is imported from and exported to.
+        """
+        self.path: str = path
+        self.json_path: str = json_path
+        self.lock: th.RLock = th.RLock()
+        self.db: sqlite3.Connection | None = None
+
+    def _open(self) -> sqlite3.Connection:
+        """Returns the database connection, opening it and importing a newer validation.json if needed."""
+        with self.lock:
+            if self.db is not None:
+                return self.db
+
+            db: sqlite3.Connection = sqlite3.connect(self.path, check_same_thread=False)
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS students (
+                    hash TEXT PRIMARY KEY,
+                    name TEXT NOT NULL
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+            db.commit()
+            self.db = db
+
+            imported: tuple[str] | None = db.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone()
+            empty: bool = db.execute("SELECT NOT EXISTS (SELECT 1 FROM students)").fetchone()[0] == 1
+            if os.path.exists(self.json_path):
+                if empty or imported is None or os.path.getmtime(self.json_path) > float(imported[0]):
+                    self.import_json(self.json_path)
+
+            elif empty:
+                # Nothing to import from, let FileIO report it and offer to download it from AWS
+                from resources.scripts.FileIO import read
+                read(self.json_path)
+
+            return db
+
+    def __contains__(self, data: object) -> bool:
+        with self.lock:
+            return self._open().execute("SELECT 1 FROM students WHERE hash = ?", (data,)).fetchone() is not None
+
+    def __getitem__(self, data: str) -> str:
+        name: str | None = self.get(data)
+        if name is None:
+            raise KeyError(data)
+
+        return name
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self._open().execute("SELECT COUNT(*) FROM students").fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        with self.lock:
+            return iter([row[0] for row in self._open().execute("SELECT hash FROM students")])
+
+    def get(self, data: str) -> str | None:
+        """Looks up the student a QR code belongs to.
+
+        Args:
+            data: The decoded QR code data.
+
+        Returns:
+            The student's name, or None if the code is not a student code.
+        """
+        with self.lock:
+            row: tuple[str] | None = self._open().execute(
+                "SELECT name FROM students WHERE hash = ?", (data,)
+            ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def add(self, data: str, name: str) -> bool:
+        """Adds one student.
+
+        Args:
+            data: The hash printed on the student's QR code.
+            name: The student's name.
+
+        Returns:
+            True if the student was added, False if the hash was already stored.
+        """
+        return self.add_many([(data, name)]) == 1
+
+    def add_many(self, students: Iterable[tuple[str, str]]) -> int:
+        """Adds students in a single transaction, skipping hashes that are already stored.
+
+        Args:
+            students: (hash, name) pairs.
+
+        Returns:
+            The number of students added.
+        """
+        with self.lock:
+            db: sqlite3.Connection = self._open()
+            before: int = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO students (hash, name) VALUES (?, ?)", students)
+            db.commit()
+            return db.total_changes - before
+
+    def import_json(self, path: str) -> int:
+        """Replaces the stored students with the contents of a validation.json file.
+
+        Args:
+            path: The file to import.
+
+        Returns:
+            The number of students imported.
+        """
+        with open(path, "r") as f:
+            students: dict[str, str] = json.load(f)
+
+        with self.lock:
+            db: sqlite3.Connection = self._open()
+            db.execute("DELETE FROM students")
+            db.executemany("INSERT OR REPLACE INTO students (hash, name) VALUES (?, ?)", students.items())
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (str(os.path.getmtime(path)),))
+            db.commit()
+
+        tc.print_ok(f"Imported {len(students)} students from {path}")
+        return len(students)
+
+    def export_json(self, path: str | None = None) -> dict[str, str]:
+        """Writes every stored student to a file in the validation.json format.
+
+        Args:
+            path: The file to write. Defaults to the store's validation.json.
+
+        Returns:
+            The exported hash to name mapping.
+        """
+        path = path or self.json_path
+        with self.lock:
+            students: dict[str, str] = dict(self._open().execute("SELECT hash, name FROM students"))
+
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(students, f, indent=4)
+
+            os.replace(f"{path}.tmp", path)
+
+            # The export matches the database, it does not need importing again
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (str(os.path.getmtime(path)),))
+            self.db.commit()
+
+        return students
+
+    def close(self) -> None:
+        """Closes the database. It is reopened on next use."""
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+validation = ValidationStore("resources/data/validation.db", "resources/data/validation.json")
@@ -0,0 +1,184 @@
+import time
+import queue
+import threading as th
+from typing import Callable
+from datetime import datetime
+from resources.scripts.Journal import Journal
+from resources.scripts.History import History
+from resources.scripts.Logging import write_log
+from resources.scripts.Metrics import metrics
+from resources.scripts.Settings import settings
+from resources.scripts.Storage import StorageBackend
+from resources.scripts.Scheduler import scheduler
+from resources.scripts.TermColor import TermColor
+from resources.scripts.Sheets import update, save_snapshot
+
+tc = TermColor()
+
+
+def make_entry(device: str, student: str, action: str, category: str) -> dict[str, str]:
+    """Builds the log entry for a scan, stamped with the current date and time.
+
+    Args:
+        device: The device that was scanned.
+        student: The student renting or returning it.
+        action: The device's new status, "IN" or "OUT".
+        category: The category the device belongs to.
+
+    Returns:
+        The entry to hand to SheetWriter.put.
+    """
+    current_time: datetime = datetime.now()
+    return {
+        "action": action,
+        "device": device,
+        "date": f"{current_time.day}/{current_time.month}/{current_time.year}",
+        "student": student,
+        "time": f"{current_time.hour:02d}:{current_time.minute:02d}:{current_time.second:02d}",
+        "category": category,
+    }
+
+
+class SheetWriter:
+    def __init__(self, backend: StorageBackend, journal: Journal, snapshot: str,
+                 reconnect: Callable[[], bool] | None = None, history: History | None = None):
+        """Initializes the single thread that pushes queued scans to the sheet.
+
+        Scans are flushed once "flush size" of them are waiting or "flush seconds" have passed
+        since the last flush, whichever comes first. Both are read from settings on every loop
+        so they can be changed while running.
+
+        A flush that cannot reach the storage puts the writer offline. Scans keep being journaled
+        and queued, and each "flush seconds" the reconnect callback is tried until it succeeds,
+        before anything queued is pushed.
+
+        Args:
+            backend: The storage scans are pushed to.
+            journal: The journal the scans are persisted to. Pending entries in it are flushed first.
+            snapshot: Where to save the device status snapshot after each flush.
+            reconnect: Reconciles local state with the storage, returning whether it could be reached.
+            history: Where every scan is also recorded for reports, if anywhere.
+        """
+        self.backend: StorageBackend = backend
+        self.journal: Journal = journal
+        self.snapshot: str = snapshot
+        self.reconnect_callback: Callable[[], bool] | None = reconnect
+        self.reconnect_lock: th.Lock = th.Lock()
+        self.offline: bool = False
+        self.history: History | None = history
+        self.queue: queue.Queue[dict[str, str] | None] = queue.Queue()
+        self.batch: list[dict[str, str]] = journal.replay()
+        self.lock: th.Lock = th.Lock()
+        self.stopping: th.Event = th.Event()
+        self.last_latency: float = 0.0
+        self.thread: th.Thread = th.Thread(target=self._run, name="sheet-writer", daemon=True)
+
+    def start(self) -> None:
+        """Starts the writer thread."""
+        self.thread.start()
+
+    def put(self, entry: dict[str, str]) -> None:
+        """Journals a scan and queues it for the next flush. Never blocks on the network.
+
+        Args:
+            entry: The scan to push.
+        """
+        # Journal order has to match queue order since flushes are acknowledged by count
+        with self.lock, metrics.timer("queue.put"):
+            self.journal.append(entry)
+            self.queue.put(entry)
+            if self.history is not None:
+                self.history.append(entry)
+
+        metrics.gauge("queue.depth", self.depth())
+
+    def pending(self) -> list[dict[str, str]]:
+        """Returns a copy of every scan that has not been pushed yet, oldest first."""
+        with self.queue.mutex:
+            waiting: list[dict[str, str]] = [entry for entry in self.queue.queue if entry is not None]
+
+        return list(self.batch) + waiting
+
+    def depth(self) -> int:
+        """Returns the number of scans waiting to be pushed."""
+        return len(self.batch) + self.queue.qsize()
+
+    def reconnect(self) -> bool:
+        """Reconciles with the storage through the reconnect callback, going back online if it succeeds.
+
+        Returns:
+            True if the writer is online.
+        """
+        with self.reconnect_lock:
+            if self.reconnect_callback is not None:
+                self.offline = not self.reconnect_callback()
+
+            else:
+                self.offline = False
+
+            metrics.gauge("offline", int(self.offline))
+            return not self.offline
+
+    def _run(self) -> None:
+        """Collects queued scans and flushes them on size or time until stopped."""
+        deadline: float = time.monotonic() + settings.get().flush_interval
+        while True:
+            try:
+                entry: dict[str, str] | None = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if entry is not None:
+                    self.batch.append(entry)
+
+            except queue.Empty:
+                pass
+
+            if self.stopping.is_set() and self.queue.empty():
+                self._flush()
+                return
+
+            # While offline only the timer triggers flushes, each one is a reconnect attempt
+            full: bool = len(self.batch) >= settings.get().flush_size and not self.offline
+            if full or time.monotonic() >= deadline:
+                self._flush()
+                deadline = time.monotonic() + settings.get().flush_interval
+
+    def _flush(self) -> None:
+        """Pushes the current batch, requeueing whatever the sheet did not accept."""
+        if len(self.batch) == 0:
+            tc.print_ok("No entries. Skipping update.")
+            return
+
+        if self.offline and not self.reconnect():
+            tc.print_warning(f"Storage still unreachable. {self.depth()} scans waiting")
+            return
+
+        flushed: int = len(self.batch)
+        started: float = time.monotonic()
+        try:
+            result = update(self.batch[:flushed], self.backend)
+
+            # Entries whose rows failed to write go back to the front of the batch
+            self.batch = result.retry + self.batch[flushed:]
+            self.journal.ack(flushed, result.retry)
+            save_snapshot(self.snapshot, self.backend)
+
+        # Quota or network trouble that outlasted the scheduler's retries, keep everything for next round
+        except (Exception,):
+            tc.print_fail("Could not update sheet. Working offline, scans stay queued for the next update")
+            write_log()
+            self.offline = True
+            metrics.gauge("offline", 1)
+
+        self.last_latency = time.monotonic() - started
+        metrics.observe("flush", self.last_latency)
+        metrics.gauge("queue.depth", self.depth())
+        tc.print_ok(f"Flush took {self.last_latency:.2f}s. {self.depth()} scans waiting. {scheduler.describe()}")
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Flushes whatever is left and stops the writer thread.
+
+        Args:
+            timeout: Seconds to wait for the final flush.
+        """
+        self.stopping.set()
+        self.queue.put(None)
+        self.thread.join(timeout=timeout)